@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 from streamMaker import StreamMaker
+from sampleStore import save_samples
+from lockstepSketch import lockstep_sketch
 from jaggedSketchSimple import JaggedSketch
 import argparse
 from collections import namedtuple
@@ -26,6 +28,16 @@ def run_the_sketch(n, order, q, J, epsilon, mem_name=''):
 			mem.close()
 		return sketch
 
+# All runs at once in one lockstep sketch (see lockstepSketch)
+def run_lockstep(n, order, q, J, epsilon, repeat, stream=None):
+	sketch = lockstep_sketch(repeat, 'simple', dtype='int64', epsilon=epsilon,
+		important_quantiles=q, constant_J=J
+	)
+	if stream is None:
+		stream = StreamMaker().make(n=n, order=order)
+	sketch.update_many(stream)
+	return sketch
+
 def bisect(n, order, q, j, space):
 	cap = 0
 	small = 0.001
@@ -75,6 +87,14 @@ def main():
 	parser.add_argument(
 		'-space', type=float, default=10020, 
 	)
+	parser.add_argument(
+		'--lockstep', action='store_true',
+		help='build all the repeats in one pass as replicas of a lockstep sketch'
+	)
+	parser.add_argument(
+		'--pickle', action='store_true',
+		help='store the whole pickled Sampling object instead of the columnar .npz file'
+	)
 	args = parser.parse_args()
 	
 	# parse input
@@ -98,28 +118,35 @@ def main():
 	
 	# check files and folders
 	os.makedirs("samples", exist_ok=True)
-	if repeat > 1 and os.path.isfile(f"samples/{filename}"):
+	if repeat > 1 and (os.path.isfile(f"samples/{filename}") or
+			os.path.isfile(f"samples/{filename}.npz")):
 		exit("file already exists")
 	
-	mem_name = ''
-	if order == "random":
-		rng = np.random.default_rng()
-		a = np.array(rng.permutation(np.arange(1,n+1)))
-		mem = shared_memory.SharedMemory(create=True, size=a.nbytes)
-		random_stream = np.ndarray((n,), np.int64, buffer=mem.buf)
-		random_stream[:] = a[:]
-		mem_name = mem.name
+	if args.lockstep:
+		stream = None
+		if order == "random":
+			stream = np.random.default_rng().permutation(np.arange(1,n+1))
+		runs = [run_lockstep(n, order, q, J, epsilon, repeat, stream)]
+	else:
+		mem_name = ''
+		if order == "random":
+			rng = np.random.default_rng()
+			a = np.array(rng.permutation(np.arange(1,n+1)))
+			mem = shared_memory.SharedMemory(create=True, size=a.nbytes)
+			random_stream = np.ndarray((n,), np.int64, buffer=mem.buf)
+			random_stream[:] = a[:]
+			mem_name = mem.name
 	
-	# run the sketch in paralel "repeat" times
-	with mp.Pool() as pool:
-		async_runs = [pool.apply_async(
-				run_the_sketch, (n, order, q, J, epsilon, mem_name)
-			) for _ in range(repeat)]
-		runs = [x.get() for x in async_runs]
+		# run the sketch in paralel "repeat" times
+		with mp.Pool() as pool:
+			async_runs = [pool.apply_async(
+					run_the_sketch, (n, order, q, J, epsilon, mem_name)
+				) for _ in range(repeat)]
+			runs = [x.get() for x in async_runs]
 	
-	if order == "random":
-		mem.close()
-		mem.unlink()
+		if order == "random":
+			mem.close()
+			mem.unlink()
 	
 	# get skech info
 	s = runs[0]
@@ -135,12 +162,17 @@ def main():
 		for c in s.compactors:
 			print(f"ss: {c.section_size}, comp: {c.num_compactions} B: {c.capacity}")
 
-	ranks = [r.ranks() for r in runs]
+	if args.lockstep:
+		ranks = s.replica_rank_lists()
+	else:
+		ranks = [r.ranks() for r in runs]
 	
 	# dump the results to file
-	if repeat > 1:
+	if repeat > 1 and args.pickle:
 		with open(f"samples/{filename}", mode='xb') as file:
 			pickle.dump(Sampling(ranks, sketch_info, n), file)
+	elif repeat > 1:
+		save_samples(Sampling(ranks, sketch_info, n), f"samples/{filename}.npz")
 
 class Sampling():
 
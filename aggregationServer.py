@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+import jaggedSketchImproved, jaggedSketchSimple
+from streamMaker import StreamMaker
+from bisect import bisect_left, bisect_right
+import asyncio, argparse, json, struct, time, os, tempfile
+import numpy as np
+
+# CONSTANTS
+# Sketch classes by the variant stored in their to_dict()
+VARIANTS = {
+	'simple': jaggedSketchSimple.JaggedSketch,
+	'improved': jaggedSketchImproved.JaggedSketch,
+}
+# Messages are JSON objects preceded by their length as 4 bytes (big endian)
+HEADER = struct.Struct('>I')
+MAX_MESSAGE = 1 << 28
+
+# Central service merging the sketches pushed by the ingestion nodes and
+# answering queries over them; the pushed sketches of one key must summarize
+# disjoint parts of the input (e.g. every node pushes a fresh sketch of the
+# items received since its previous push);
+# requests (all with "op" and most with "key"):
+#   push      "sketch": to_dict() of a sketch, merged into the key
+#   quantile  "q": a number or a list of numbers
+#   rank      "value": a number or a list of numbers
+#   cdf       "split_points": sorted numbers, answered like get_cdf
+#   keys, stats
+# replies are {"ok": true, "result": ...} or {"ok": false, "error": message}
+class AggregationServer:
+	def __init__(self):
+		self.sketches = {}
+		# Sorted items and their ranks of every key, valid until the next push
+		self.cache = {}
+		self.hits = 0
+		self.misses = 0
+		self.server = None
+
+	# Starts listening on a (host, port) pair or on a unix socket path;
+	# port 0 picks a free port, see address()
+	async def start(self, address):
+		if isinstance(address, str):
+			self.server = await asyncio.start_unix_server(self.handle, path=address)
+		else:
+			self.server = await asyncio.start_server(self.handle, *address)
+
+	def address(self):
+		return self.server.sockets[0].getsockname()
+
+	async def close(self):
+		self.server.close()
+		await self.server.wait_closed()
+
+	# Serves the requests of one (persistent) connection in order
+	async def handle(self, reader, writer):
+		try:
+			while True:
+				try:
+					request = await read_message(reader)
+				except asyncio.IncompleteReadError:
+					break
+				try:
+					reply = {"ok": True, "result": self.execute(request)}
+				except (KeyError, ValueError, TypeError) as e:
+					reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+				write_message(writer, reply)
+				await writer.drain()
+		finally:
+			writer.close()
+
+	def execute(self, request):
+		op = request["op"]
+		if op == "push":
+			return self.push(request["key"], request["sketch"])
+		if op == "quantile":
+			return self.answer(request["key"], quantile_of, request["q"])
+		if op == "rank":
+			return self.answer(request["key"], rank_of, request["value"])
+		if op == "cdf":
+			return cdf_of(self.ranks(request["key"]), request["split_points"])
+		if op == "keys":
+			return sorted(self.sketches)
+		if op == "stats":
+			return self.stats()
+		raise ValueError(f"unknown operation {op}")
+
+	# Merges the pushed sketch into the key; returns the merged N
+	def push(self, key, sketch_dict):
+		if sketch_dict["variant"] not in VARIANTS:
+			raise ValueError(f"unknown variant {sketch_dict['variant']}")
+		sketch = VARIANTS[sketch_dict["variant"]].from_dict(sketch_dict)
+		if key in self.sketches:
+			# merged into a copy, so that a failed merge (e.g. of items that
+			# cannot be compared with those of the key) leaves the key intact
+			merged = type(self.sketches[key]).from_dict(self.sketches[key].to_dict())
+			merged.merge(sketch)
+			sketch = merged
+		self.sketches[key] = sketch
+		self.cache.pop(key, None)
+		return self.sketches[key].N
+
+	# Items, cumulative weights and N of the merged sketch of the key
+	def ranks(self, key):
+		if key not in self.sketches:
+			raise KeyError(f"no sketch for key {key}")
+		if key in self.cache:
+			self.hits += 1
+		else:
+			self.misses += 1
+			sketch = self.sketches[key]
+			ranks = sketch.ranks()
+			self.cache[key] = ([x for (x, _) in ranks], [r for (_, r) in ranks], sketch.N)
+		return self.cache[key]
+
+	def answer(self, key, function, argument):
+		ranks = self.ranks(key)
+		if isinstance(argument, list):
+			return [function(ranks, a) for a in argument]
+		return function(ranks, argument)
+
+	def stats(self):
+		return {
+			"keys": len(self.sketches), "cache_hits": self.hits, "cache_misses": self.misses,
+			"N": {key: s.N for (key, s) in self.sketches.items()},
+			"size": {key: s.size for (key, s) in self.sketches.items()}
+		}
+
+# Client keeping up to pool_size persistent connections to the server,
+# which are reused by the concurrent requests
+class AggregationClient:
+	def __init__(self, address, pool_size=4):
+		if pool_size < 1:
+			raise ValueError("pool_size must be positive")
+		self.address = address
+		self.pool_size = pool_size
+		# One slot per connection; a request holds its slot until it returns
+		# the connection or closes a broken one, so waiting requests always
+		# get an idle connection or may open a new one
+		self.slots = asyncio.Semaphore(pool_size)
+		self.idle = []
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *exc):
+		await self.close()
+
+	async def connect(self):
+		if isinstance(self.address, str):
+			return await asyncio.open_unix_connection(self.address)
+		return await asyncio.open_connection(*self.address)
+
+	async def request(self, message):
+		async with self.slots:
+			(reader, writer) = self.idle.pop() if self.idle else await self.connect()
+			try:
+				write_message(writer, message)
+				await writer.drain()
+				reply = await read_message(reader)
+			except BaseException:
+				# the connection is in an unknown state
+				writer.close()
+				raise
+			self.idle.append((reader, writer))
+		if not reply["ok"]:
+			raise RuntimeError(reply["error"])
+		return reply["result"]
+
+	async def push(self, key, sketch):
+		return await self.request({"op": "push", "key": key, "sketch": sketch.to_dict()})
+
+	async def quantile(self, key, q):
+		return await self.request({"op": "quantile", "key": key, "q": q})
+
+	async def rank(self, key, value):
+		return await self.request({"op": "rank", "key": key, "value": value})
+
+	async def cdf(self, key, split_points):
+		return await self.request({"op": "cdf", "key": key, "split_points": split_points})
+
+	async def keys(self):
+		return await self.request({"op": "keys"})
+
+	async def stats(self):
+		return await self.request({"op": "stats"})
+
+	async def close(self):
+		while self.idle:
+			(_, writer) = self.idle.pop()
+			writer.close()
+			await writer.wait_closed()
+
+# AUXILIARY FUNCTIONS
+
+def write_message(writer, message):
+	data = json.dumps(message).encode()
+	writer.write(HEADER.pack(len(data)) + data)
+
+async def read_message(reader):
+	(length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+	if length > MAX_MESSAGE:
+		raise ValueError(f"message of {length} bytes is too large")
+	return json.loads(await reader.readexactly(length))
+
+# The answers below are the same as those of the merged sketch itself
+
+def quantile_of(ranks, q):
+	(items, cum_weights, N) = ranks
+	if not 0 <= q <= 1:
+		raise ValueError(f"parameter q must be in [0, 1], but q = {q}")
+	if not items:
+		return None
+	return items[min(bisect_left(cum_weights, q*N), len(items) - 1)]
+
+def rank_of(ranks, value):
+	(items, cum_weights, _) = ranks
+	i = bisect_right(items, value)
+	return cum_weights[i-1] if i > 0 else 0
+
+def cdf_of(ranks, split_points):
+	(items, cum_weights, _) = ranks
+	if any(a > b for (a, b) in zip(split_points, split_points[1:])):
+		raise ValueError("split points must be sorted")
+	total_weight = cum_weights[-1] if cum_weights else 1
+	return [rank_of(ranks, x) / total_weight for x in split_points] + [1.0]
+
+# Localhost stand-in for the cluster: every node sketches its share of the
+# stream and pushes a fresh sketch after every batch, then the merged
+# sketch is queried and compared to the true ranks
+async def run_demo(n, order, nodes, batch, pool_size, epsilon, variant, use_unix):
+	server = AggregationServer()
+	if use_unix:
+		address = os.path.join(tempfile.mkdtemp(), "aggregation.sock")
+		await server.start(address)
+	else:
+		await server.start(('127.0.0.1', 0))
+		address = server.address()[:2]
+	stream = list(StreamMaker().make(n=n, order=order))
+	n = len(stream)
+	sketch_class = VARIANTS[variant]
+
+	pushes = 0
+	async with AggregationClient(address, pool_size) as client:
+		async def node(i):
+			nonlocal pushes
+			items = stream[i::nodes]
+			for start in range(0, len(items), batch):
+				sketch = sketch_class(epsilon=epsilon)
+				sketch.update_many(items[start : start+batch])
+				await client.push('demo', sketch)
+				pushes += 1
+				await asyncio.sleep(0) # let the other nodes in
+
+		start = time.perf_counter()
+		await asyncio.gather(*(node(i) for i in range(nodes)))
+		elapsed = time.perf_counter() - start
+
+		true_ranks = np.sort(np.asarray(stream))
+		qs = [0.001, 0.01, 0.1, 0.5, 0.9, 0.99, 0.999]
+		start = time.perf_counter()
+		for _ in range(100):
+			answers = await client.quantile('demo', qs)
+		query_time = (time.perf_counter() - start) / 100
+		stats = await client.stats()
+
+	await server.close()
+	if use_unix:
+		os.remove(address)
+		os.rmdir(os.path.dirname(address))
+
+	print(f"nodes: {nodes}, pushes: {pushes}, items: {stats['N']['demo']}, "
+		f"ingest: {elapsed:.2f}s, connections: {pool_size}")
+	print(f"merged size: {stats['size']['demo']}, query: {query_time*1000:.2f}ms, "
+		f"cache hits/misses: {stats['cache_hits']}/{stats['cache_misses']}")
+	for (q, x) in zip(qs, answers):
+		r = np.searchsorted(true_ranks, x, side='right')
+		print(f"q={q}: item {x}, true quantile {r / n:.5f}")
+
+def main():
+	parser = argparse.ArgumentParser(description=
+		'Localhost demo of the aggregation server for Jagged Sketches.'
+	)
+	parser.add_argument(
+		'-n', type=int, default=1000000,
+		help='the number of streamed items'
+	)
+	parser.add_argument(
+		'-order', type=str, default='random', choices=StreamMaker().orders,
+		help='the order of the streamed integers'
+	)
+	parser.add_argument(
+		'-nodes', type=int, default=8,
+		help='the number of simulated ingestion nodes'
+	)
+	parser.add_argument(
+		'-batch', type=int, default=50000,
+		help='the number of items a node sketches before every push'
+	)
+	parser.add_argument(
+		'-pool', type=int, default=4,
+		help='the number of pooled client connections'
+	)
+	parser.add_argument(
+		'-epsilon', type=float, default=0.01,
+	)
+	parser.add_argument(
+		'-variant', type=str, default='improved', choices=sorted(VARIANTS),
+	)
+	parser.add_argument(
+		'--unix', action='store_true',
+		help='use a unix socket instead of a localhost TCP connection'
+	)
+	args = parser.parse_args()
+	asyncio.run(run_demo(args.n, args.order, args.nodes, args.batch, args.pool,
+		args.epsilon, args.variant, args.unix))
+
+if __name__ == '__main__':
+	main()
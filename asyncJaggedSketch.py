@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+from jaggedSketchImproved import JaggedSketch
+from streamMaker import StreamMaker
+import asyncio, threading, argparse, time, os, tempfile
+
+# Asyncio front-end for a JaggedSketch: items are collected into batches,
+# the batches go through an asyncio.Queue and are inserted in bulk by a thread
+# executor, so that long compactions never block the event loop
+class AsyncJaggedSketch:
+	def __init__(self, sketch=None, batch_size=4096, max_batches=16,
+			executor=None, **sketch_args):
+		if batch_size < 1:
+			raise ValueError("batch_size must be positive")
+		self.sketch = sketch if sketch is not None else JaggedSketch(**sketch_args)
+		self.batch_size = batch_size
+		# Bounded intake gives back-pressure to fast producers
+		self.queue = asyncio.Queue(maxsize=max_batches)
+		# None means the default executor of the running loop
+		self.executor = executor
+		# Guards the sketch; queries hold it to read a consistent snapshot
+		self.lock = threading.Lock()
+		self.batch = []
+		self.worker = None
+		# First error of an insertion, raised by the next submit/flush/close
+		self.error = None
+
+	async def __aenter__(self):
+		self.start()
+		return self
+
+	async def __aexit__(self, *exc):
+		await self.close()
+
+	# Starts the task draining the intake queue (called lazily by put), or a
+	# new one if the previous task has stopped
+	def start(self):
+		if self.worker is not None and self.worker.done():
+			if not self.worker.cancelled() and self.error is None:
+				self.error = self.worker.exception()
+			self.worker = None
+		if self.worker is None:
+			self.worker = asyncio.get_running_loop().create_task(self.drain())
+
+	# A failed batch does not stop the task: its error is kept for the
+	# callers and the following batches are still inserted
+	async def drain(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			batch = await self.queue.get()
+			try:
+				await loop.run_in_executor(self.executor, self.ingest, batch)
+			except Exception as e:
+				if self.error is None:
+					self.error = e
+			finally:
+				self.queue.task_done()
+
+	# Raises the kept error of an insertion (once)
+	def check(self):
+		if self.error is not None:
+			error, self.error = self.error, None
+			raise error
+
+	# Runs in the executor thread; a batch with items that cannot be ordered
+	# (among themselves or with the items of the sketch) raises before any
+	# of them is inserted, since they would break every later compaction
+	def ingest(self, batch):
+		if not batch:
+			return
+		(lowest, highest) = (min(batch), max(batch))
+		with self.lock:
+			for c in self.sketch.compactors:
+				if len(c) > 0:
+					lowest <= c[0] <= highest
+					break
+			self.sketch.update_many(batch)
+
+	async def put(self, item):
+		self.batch.append(item)
+		if len(self.batch) >= self.batch_size:
+			await self.submit()
+
+	async def put_many(self, items):
+		self.batch.extend(items)
+		if len(self.batch) >= self.batch_size:
+			await self.submit()
+
+	# Hands the current batch over to the intake queue; raises the error of
+	# an earlier batch instead
+	async def submit(self):
+		self.start()
+		self.check()
+		if self.batch:
+			batch, self.batch = self.batch, []
+			await self.queue.put(batch)
+
+	# Waits until every item put so far is in the sketch; raises the error
+	# of a batch that could not be inserted
+	async def flush(self):
+		await self.submit()
+		await self.queue.join()
+		self.check()
+
+	async def consume(self, async_iterable):
+		async for item in async_iterable:
+			await self.put(item)
+		await self.flush()
+
+	async def close(self):
+		try:
+			await self.flush()
+		finally:
+			if self.worker is not None:
+				self.worker.cancel()
+				try:
+					await self.worker
+				except asyncio.CancelledError:
+					pass
+				self.worker = None
+
+	# Runs a read-only query on a snapshot taken between two batches
+	async def query(self, function, *args):
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self.executor, self.locked, function, args)
+
+	def locked(self, function, args):
+		with self.lock:
+			return function(*args)
+
+	async def quantile(self, q):
+		return await self.query(self.sketch.quantile, q)
+
+	async def rank(self, value):
+		return await self.query(self.sketch.rank, value)
+
+	async def cdf(self):
+		return await self.query(self.sketch.cdf)
+
+	# Number of items already inserted into the sketch
+	def N(self):
+		return self.sketch.N
+
+# AUXILIARY FUNCTIONS
+
+# Parses a block of whitespace separated numbers
+def parse_numbers(block):
+	numbers = []
+	for token in block.split():
+		try:
+			numbers.append(int(token))
+		except ValueError:
+			numbers.append(float(token))
+	return numbers
+
+# Feeds newline-delimited numbers read from a stream into the sketch
+async def consume_stream(reader, async_sketch, chunk_size=1<<16):
+	rest = b''
+	while True:
+		data = await reader.read(chunk_size)
+		if not data:
+			break
+		data = rest + data
+		cut = data.rfind(b'\n') + 1
+		rest = data[cut:]
+		await async_sketch.put_many(parse_numbers(data[:cut]))
+	await async_sketch.put_many(parse_numbers(rest))
+	await async_sketch.flush()
+
+# Throughput harness: streams numbers through a local socket into the sketch
+async def run_harness(n, order, batch_size, epsilon, use_unix):
+	done = asyncio.Event()
+	async_sketch = AsyncJaggedSketch(batch_size=batch_size, epsilon=epsilon)
+
+	async def handle(reader, writer):
+		await consume_stream(reader, async_sketch)
+		writer.close()
+		done.set()
+
+	if use_unix:
+		path = os.path.join(tempfile.mkdtemp(), "jaggedsketch.sock")
+		server = await asyncio.start_unix_server(handle, path=path)
+		_, writer = await asyncio.open_unix_connection(path)
+	else:
+		server = await asyncio.start_server(handle, host='127.0.0.1', port=0)
+		port = server.sockets[0].getsockname()[1]
+		_, writer = await asyncio.open_connection('127.0.0.1', port)
+
+	# the event loop must stay responsive while the sketch is being built
+	max_lag = 0
+	async def heartbeat():
+		nonlocal max_lag
+		while not done.is_set():
+			start = time.perf_counter()
+			await asyncio.sleep(0.01)
+			max_lag = max(max_lag, time.perf_counter() - start - 0.01)
+	beat = asyncio.get_running_loop().create_task(heartbeat())
+
+	start = time.perf_counter()
+	lines = []
+	for item in StreamMaker().make(n=n, order=order):
+		lines.append(b'%d\n' % item)
+		if len(lines) >= batch_size:
+			writer.write(b''.join(lines))
+			lines = []
+			await writer.drain()
+	writer.write(b''.join(lines))
+	await writer.drain()
+	writer.close()
+	await done.wait()
+	elapsed = time.perf_counter() - start
+	await beat
+
+	median = await async_sketch.quantile(0.5)
+	await async_sketch.close()
+	server.close()
+	await server.wait_closed()
+	if use_unix:
+		os.remove(path)
+		os.rmdir(os.path.dirname(path))
+
+	print(f"items: {async_sketch.N()}, time: {elapsed:.2f}s, "
+		f"throughput: {async_sketch.N() / elapsed:.0f} items/s")
+	print(f"max event loop lag: {max_lag*1000:.1f}ms, median: {median}")
+
+def main():
+	parser = argparse.ArgumentParser(description=
+		'Throughput harness for the asyncio front-end of Jagged Sketch.'
+	)
+	parser.add_argument(
+		'-n', type=int, default=1000000,
+		help='the number of streamed items'
+	)
+	parser.add_argument(
+		'-order', type=str, default='random', choices=StreamMaker().orders,
+		help='the order of the streamed integers'
+	)
+	parser.add_argument(
+		'-batch', type=int, default=4096,
+		help='the number of items inserted into the sketch at once'
+	)
+	parser.add_argument(
+		'-epsilon', type=float, default=0.01,
+	)
+	parser.add_argument(
+		'--unix', action='store_true',
+		help='use a unix socket instead of a localhost TCP connection'
+	)
+	args = parser.parse_args()
+	asyncio.run(run_harness(args.n, args.order, args.batch, args.epsilon, args.unix))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+from jaggedSketchImproved import JaggedSketch
+from streamMaker import StreamMaker
+import argparse, hashlib, json, os, random
+import multiprocessing as mp
+from bisect import bisect_right
+from math import ceil
+from pprint import pprint
+
+# CONSTANTS
+# The error at a target quantile q is measured at the ranks q*n +- 1.05**i
+# up to this fraction of n away from q*n
+TARGET_SPREAD = 0.1
+
+# Data sample shared by the worker processes (set by the pool initializer)
+sample = None
+ordered_sample = None
+
+def set_sample(data):
+	global sample, ordered_sample
+	sample = data
+	ordered_sample = sorted(data)
+
+# Items at geometrically growing distances on both sides of the rank q*n,
+# so that a target is not judged by one item (at q = 0 the smallest item,
+# whose rank is always exact)
+def target_points(q):
+	n = len(ordered_sample)
+	center = q * n
+	ranks = {max(1, ceil(center))}
+	i = 0
+	while 1.05**i <= TARGET_SPREAD * n:
+		ranks.update(r for r in (round(center - 1.05**i), round(center + 1.05**i)) if 1 <= r <= n)
+		i += 1
+	return sorted({ordered_sample[r-1] for r in ranks})
+
+# Builds one replica of the sketch on the sample and returns the largest
+# relative errors around the target ranks
+def run_replica(epsilon, J, improvement, Q, delta, seed):
+	random.seed(seed)
+	sketch = JaggedSketch(epsilon=epsilon, delta=delta, important_quantiles=Q,
+		constant_J=J, improvement_for_high_ranks=improvement
+	)
+	sketch.update_many(sample)
+	errors = {}
+	for q in Q:
+		errors[q] = 0
+		for x in target_points(q):
+			true_rank = bisect_right(ordered_sample, x)
+			errors[q] = max(errors[q], abs(sketch.rank(x) - true_rank) / true_rank)
+	return errors
+
+# Sum of the capacities after a sorted stream of n items (as bisect in
+# JSITest); the capacities grow with the height, i.e. with N, so they are
+# measured at the length of the real stream rather than of the sample
+def stream_space(epsilon, J, improvement, Q, delta, n):
+	random.seed(0)
+	sketch = JaggedSketch(epsilon=epsilon, delta=delta, important_quantiles=Q,
+		constant_J=J, improvement_for_high_ranks=improvement
+	)
+	sketch.update_many(range(1, n+1))
+	return sum(c.capacity for c in sketch.compactors)
+
+class Tuner():
+	def __init__(self, data, Q, space, stream_length=None, replicas=5, delta=0.01,
+			cache_file='tuning_cache.json'):
+		self.data = data
+		self.Q = sorted(Q)
+		self.space = space
+		# Expected number of items of the stream the sketch is tuned for
+		self.stream_length = stream_length if stream_length is not None else len(data)
+		self.replicas = replicas
+		self.delta = delta
+		self.cache_file = cache_file
+		self.cache = {}
+		if os.path.isfile(cache_file):
+			with open(cache_file) as file:
+				self.cache = json.load(file)
+		self.fingerprint = hashlib.sha1(repr(data).encode()).hexdigest()
+
+	# Every evaluated configuration is cached under a hash of all of its inputs
+	def key(self, epsilon, J, improvement):
+		params = [self.fingerprint, epsilon, J, improvement, self.Q,
+			self.replicas, self.delta, TARGET_SPREAD, self.stream_length]
+		return hashlib.sha1(json.dumps(params).encode()).hexdigest()
+
+	def save_cache(self):
+		with open(self.cache_file + '.tmp', mode='w') as file:
+			json.dump(self.cache, file, indent=1)
+		os.replace(self.cache_file + '.tmp', self.cache_file)
+
+	# Evaluates all the missing configurations in a process pool and returns
+	# the results of all of them
+	def evaluate(self, configs):
+		missing = [c for c in configs if self.key(*c) not in self.cache]
+		if missing:
+			with mp.Pool(initializer=set_sample, initargs=(self.data,)) as pool:
+				async_runs = {c: [pool.apply_async(run_replica,
+						(*c, set(self.Q), self.delta, seed))
+					for seed in range(self.replicas)] for c in missing}
+				async_spaces = {c: pool.apply_async(stream_space,
+						(*c, set(self.Q), self.delta, self.stream_length))
+					for c in missing}
+				for (c, runs) in async_runs.items():
+					results = [r.get() for r in runs]
+					# the error of a configuration is the worst target of the
+					# mean (over the replicas) largest relative error around it
+					mean_errors = {q: sum(e[q] for e in results) / self.replicas
+						for q in self.Q}
+					self.cache[self.key(*c)] = {
+						"epsilon": c[0], "J": c[1], "improvement": c[2],
+						"space": async_spaces[c].get(),
+						"error": max(mean_errors.values()),
+						"errors": {str(q): e for (q, e) in mean_errors.items()}
+					}
+					self.save_cache()
+		return [self.cache[self.key(*c)] for c in configs]
+
+	# Returns the configuration with the lowest error that fits the budget
+	def tune(self, epsilons, Js, improvements=(True, False)):
+		configs = [(e, j, i) for e in epsilons for j in Js for i in improvements]
+		results = self.evaluate(configs)
+		fitting = [r for r in results if r["space"] <= self.space]
+		if not fitting:
+			return None
+		return min(fitting, key=lambda r: (r["error"], r["space"]))
+
+# AUXILIARY FUNCTIONS
+def read_sample(path):
+	with open(path) as file:
+		return [float(x) if '.' in x or 'e' in x else int(x) for x in file.read().split()]
+
+def geometric_grid(small, big, steps):
+	return [round(small * (big/small)**(i/(steps-1)), 6) for i in range(steps)]
+
+def main():
+	parser = argparse.ArgumentParser(description=
+		'Chooses epsilon, J and the improvement for high ranks under a space budget.'
+	)
+	parser.add_argument(
+		'-data', type=str, default='',
+		help='a file with a sample of real data (one number per line)'
+	)
+	parser.add_argument(
+		'-n', type=int, default=100000,
+		help='the number of generated elements when no data is given'
+	)
+	parser.add_argument(
+		'-order', type=str, default='random', choices=StreamMaker().orders,
+		help='the order of the generated elements when no data is given'
+	)
+	parser.add_argument(
+		'-q', type=float, default=[], action='append',
+		help='target quantiles, default = {0}'
+	)
+	parser.add_argument(
+		'-space', type=float, default=10020,
+		help='the budget for the sum of capacities'
+	)
+	parser.add_argument(
+		'-stream', type=int, default=0,
+		help='the expected number of items of the real stream, default = the sample size'
+	)
+	parser.add_argument(
+		'-replicas', type=int, default=5,
+		help='the number of sketches built for each configuration'
+	)
+	parser.add_argument(
+		'-epsilons', type=int, default=12,
+		help='the number of epsilons in the geometric grid between 0.001 and 0.1'
+	)
+	parser.add_argument(
+		'-j', type=float, default=[], action='append',
+		help='values of J to try, default = 0, 0.25, 0.5, 0.75, 1'
+	)
+	parser.add_argument(
+		'-cache', type=str, default='tuning_cache.json',
+		help='the file with the cached evaluations'
+	)
+	args = parser.parse_args()
+
+	if args.data != '':
+		data = read_sample(args.data)
+	else:
+		random.seed(0) # the same sample every time, so that the cache is reused
+		data = list(StreamMaker().make(n=args.n, order=args.order))
+	Q = set(args.q) if args.q != [] else {0}
+	Js = args.j if args.j != [] else [0, 0.25, 0.5, 0.75, 1]
+
+	tuner = Tuner(data, Q, args.space, args.stream or None, args.replicas, cache_file=args.cache)
+	best = tuner.tune(geometric_grid(0.001, 0.1, args.epsilons), Js)
+	if best is None:
+		exit("no configuration fits the space budget")
+	pprint(best)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+import os, pickle
+
+# CONSTANTS
+# Attributes that are not part of the logged state of a sketch; those of a
+# compactor are declared by its classes (see compactor_state)
+SKETCH_EXCLUDED = {'compactors', 'memory_callback', 'query_cache'}
+
+# Incremental persistence of a sketch (of any variant) in an append-only
+# file of pickled records; the file starts with a full snapshot and every
+# checkpoint appends only the changes of the levels since the previous one:
+# items appended to each level, sorts and deleted ranges of the compactions
+# (or the whole level when that is smaller), and the scalar state of the
+# sketch and of its compactors; after snapshot_every checkpoints the file
+# is replaced by a new snapshot
+class CheckpointLog:
+	def __init__(self, sketch, path, snapshot_every=60, sync=True):
+		self.sketch = sketch
+		self.path = path
+		self.snapshot_every = snapshot_every
+		# Whether every record is forced to the disk
+		self.sync = sync
+		self.file = None
+		self.snapshot()
+
+	# Replaces the log by a full snapshot of the sketch
+	def snapshot(self):
+		self.start_journals()
+		# the callback (often a closure) is not stored
+		callback = self.sketch.memory_callback
+		self.sketch.memory_callback = None
+		try:
+			with open(self.path + '.tmp', mode='wb') as file:
+				pickle.dump(('snapshot', self.sketch), file)
+				file.flush()
+				os.fsync(file.fileno())
+		finally:
+			self.sketch.memory_callback = callback
+		os.replace(self.path + '.tmp', self.path)
+		if self.file is not None:
+			self.file.close()
+		self.file = open(self.path, mode='ab')
+		self.checkpoints = 0
+
+	# Appends the changes since the previous checkpoint
+	def checkpoint(self):
+		if self.checkpoints + 1 >= self.snapshot_every:
+			self.snapshot()
+			return
+		levels = []
+		for c in self.sketch.compactors:
+			if c.journal is not None:
+				c.note_appended()
+			# a new level, or one whose changes are larger than the level
+			# itself (typically level zero), is written whole
+			if c.journal is None or \
+					sum(len(change[1]) for change in c.journal if change[0] == 'extend') > len(c):
+				changes = [('replace', c[:])]
+			else:
+				changes = c.journal
+			levels.append((compactor_state(c), changes))
+		record = ('delta', sketch_state(self.sketch), levels)
+		pickle.dump(record, self.file)
+		self.file.flush()
+		if self.sync:
+			os.fsync(self.file.fileno())
+		self.start_journals()
+		self.checkpoints += 1
+
+	# Changes are recorded from now on
+	def start_journals(self):
+		for c in self.sketch.compactors:
+			c.journal = []
+			c.mark = len(c)
+
+	def close(self):
+		for c in self.sketch.compactors:
+			c.journal = None
+		self.file.close()
+
+# Rebuilds the sketch from the last snapshot and the checkpoints after it;
+# a record cut off by a crash is ignored
+def recover(path):
+	sketch = None
+	with open(path, mode='rb') as file:
+		while True:
+			try:
+				record = pickle.load(file)
+			except (EOFError, pickle.UnpicklingError):
+				break
+			if record[0] == 'snapshot':
+				sketch = record[1]
+			else:
+				apply_delta(sketch, record)
+	for c in sketch.compactors:
+		c.journal = None
+	return sketch
+
+# AUXILIARY FUNCTIONS
+def sketch_state(sketch):
+	return {k: v.copy() if isinstance(v, set) else v
+		for (k, v) in sketch.__dict__.items() if k not in SKETCH_EXCLUDED}
+
+# Every class of the compactor (the storage mixins included) lists the
+# attributes it keeps out of the log in its unlogged attribute
+def compactor_state(compactor):
+	excluded = {k for cls in type(compactor).__mro__ for k in vars(cls).get('unlogged', ())}
+	return {k: v for (k, v) in compactor.__dict__.items() if k not in excluded}
+
+def apply_delta(sketch, record):
+	(_, state, levels) = record
+	for c in sketch.compactors:
+		c.journal = None
+	for (h, (compactor_dict, changes)) in enumerate(levels):
+		if h == sketch.H():
+			sketch.compactors.append(sketch.new_compactor())
+		c = sketch.compactors[h]
+		for change in changes:
+			if change[0] == 'extend':
+				c.extend(change[1])
+			elif change[0] == 'sort':
+				c.sort()
+			elif change[0] == 'replace':
+				del c[:]
+				c.extend(change[1])
+			else:
+				del c[change[1] : change[2]]
+		c.__dict__.update(compactor_dict)
+	sketch.__dict__.update(state)
+
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import jaggedSketchImproved, referenceSketch
+from streamMaker import StreamMaker
+import argparse, random, time
+
+# Average time of one normal compaction of a full level 0, including the
+# handoff of the selected half to level 1 (as done in compress)
+def time_compactions(module, epsilon, rounds, presorted, seed):
+	random.seed(seed)
+	sketch = module.JaggedSketch(epsilon=epsilon)
+	sketch.compactors.append(module.RelativeCompactor(sketch))
+	sketch.compactors[1].set_capacity_and_section_size()
+	level, next_level = sketch.compactors
+	# the capacity may grow when the schedule is reset
+	items = random.sample(range(40 * level.capacity), 4 * level.capacity)
+	if presorted:
+		items.sort()
+
+	total = 0
+	for _ in range(rounds):
+		level[:] = items[:level.capacity]
+		del next_level[:]
+		start = time.perf_counter()
+		next_level.extend(level.normal_compaction())
+		total += time.perf_counter() - start
+	return total / rounds
+
+def time_updates(module, stream, epsilon, seed):
+	random.seed(seed)
+	sketch = module.JaggedSketch(epsilon=epsilon)
+	start = time.perf_counter()
+	for item in stream:
+		sketch.update(item)
+	return time.perf_counter() - start
+
+def main():
+	parser = argparse.ArgumentParser(description=
+		'Compares the compaction cost of the optimized and the reference sketch.'
+	)
+	parser.add_argument(
+		'-n', type=int, default=1000000,
+		help='the number of items for the end-to-end measurement'
+	)
+	parser.add_argument(
+		'-order', type=str, default='random', choices=StreamMaker().orders,
+		help='the order of the streamed integers'
+	)
+	parser.add_argument(
+		'-epsilon', type=float, default=0.01,
+	)
+	parser.add_argument(
+		'-rounds', type=int, default=2000,
+		help='the number of timed compactions'
+	)
+	parser.add_argument(
+		'-seed', type=int, default=1,
+	)
+	args = parser.parse_args()
+
+	modules = [('reference', referenceSketch), ('optimized', jaggedSketchImproved)]
+	for presorted in (False, True):
+		times = [time_compactions(m, args.epsilon, args.rounds, presorted, args.seed)
+			for (_, m) in modules]
+		print(f"per compaction ({'presorted' if presorted else 'random'} level): "
+			f"reference {times[0]*1e6:.1f}us, optimized {times[1]*1e6:.1f}us, "
+			f"speedup {times[0]/times[1]:.2f}x")
+
+	stream = list(StreamMaker().make(n=args.n, order=args.order))
+	times = [time_updates(m, stream, args.epsilon, args.seed) for (_, m) in modules]
+	print(f"{len(stream)} updates ({args.order}): "
+		f"reference {times[0]:.2f}s, optimized {times[1]:.2f}s, "
+		f"speedup {times[0]/times[1]:.2f}x")
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,609 @@
+#!/usr/bin/python3
+
+import sys
+from math import log
+from heapq import merge
+from bisect import bisect_right
+from itertools import groupby, repeat
+from operator import itemgetter
+from collections import namedtuple
+from quantileSummary import Summary
+try:
+	import numpy as np
+except ImportError: # only the array queries need NumPy
+	np = None
+
+# CONSTANTS
+SMALLEST_MEANINGFUL_SECTION_SIZE = 4
+# The query cache is emptied when it has this many answers
+QUERY_CACHE_SIZE = 1024
+
+# Result of JaggedSketchCore.compare: the Kolmogorov-Smirnov distance and
+# the item where it is attained, the largest difference of the normalized
+# ranks relative to the smaller of them (as in the relative guarantee of the
+# sketches), the pairs of quantiles
+# (this sketch, the other) at the requested q's and their differences (the
+# other minus this), and the bounds on the error of ks and of the relative
+# difference caused by the sketches
+Comparison = namedtuple('Comparison', ['ks', 'ks_item', 'max_relative_difference',
+	'quantiles', 'quantile_deltas', 'ks_bound', 'relative_bound'])
+
+# Engine shared by jaggedSketchSimple and jaggedSketchImproved; the variants
+# supply the policies by overriding:
+#   new_compactor         the compactor class (capacity formula, randomization)
+#   update                the way items enter the sketch
+#   compress_levels       the compactions triggered by an update
+#   over_capacity         when the compactions are needed
+#   room                  how many items fit to level zero before compress()
+#   update_important_levels   the derivation of the important levels
+# and name themselves by the class attribute variant (see to_dict)
+class JaggedSketchCore:
+	def __init__(self, epsilon=0.01, delta=0.01, important_quantiles={0}, constant_J=0.5):
+		if epsilon <= 0 or epsilon > 1:
+			raise ValueError("epsilon must be between 0 and 1")
+		if delta <= 0 or delta > 0.5:
+			raise ValueError("delta must be between 0 and 0.5")
+		check_importance(important_quantiles, constant_J)
+		# Set of quantiles with higher accuracy
+		self.important_quantiles = important_quantiles
+		# Gives importance of quantiles in Q;
+		# J=0 means all quantiles have the same importance
+		self.J = constant_J
+		# Relative error for the desired rank in Q (quarantee from the theory)
+		self.epsilon = epsilon
+		# Delta is the probability of error larger than epsilon for given query
+		self.delta = delta
+		self.probability_constant = log(1/delta)**0.5
+		# Size of the input summarized
+		self.N = 0
+		# Current number of saved items
+		self.size = 0
+		# Sum of capacities of all compactors
+		self.capacity = 0
+		# Levels corresponding to important quantiles
+		self.important_levels = set()
+		# Optional memory_callback(sketch, bytes) fired when the footprint
+		# exceeds memory_limit bytes (see set_memory_limit)
+		self.memory_limit = None
+		self.memory_callback = None
+		self.over_memory_limit = False
+		# Set when levels exceed the capacities lowered by set_important_quantiles
+		self.draining = False
+		# Optional cache of quantile and rank answers (see set_query_cache)
+		self.query_tolerance = None
+		self.query_cache = {}
+		self.query_cache_hits = 0
+		self.query_cache_misses = 0
+		self.compactors = []
+		self.compactors.append(self.new_compactor())
+		self.compactors[0].set_capacity_and_section_size()
+
+	def H(self):
+		return len(self.compactors)
+
+	# Adds new compactor to the sketch
+	def grow(self):
+		# Add a new compactor
+		self.compactors.append(self.new_compactor())
+		self.compactors[-1].set_capacity_and_section_size()
+
+		# Do the full compaction for all compactors
+		for (h, compactor) in enumerate(self.compactors[:self.H()-1]):
+			self.compactors[h+1].extend(compactor.full_compaction())
+		while self.compactors[-1].is_full():
+			self.compactors.append(self.new_compactor())
+			self.compactors[-1].set_capacity_and_section_size()
+			self.compactors[-1].extend(self.compactors[-2].full_compaction())
+
+		# Update all the parameters
+		self.update_important_levels()
+		for c in self.compactors:
+			c.set_capacity_and_section_size()
+
+	# Whether items are added one by one in update_many
+	def per_item_updates(self):
+		return self.draining
+
+	# Adds all items from an iterable; level zero is filled in bulk up to
+	# room(), so compressions happen exactly as with update()
+	def update_many(self, items):
+		if hasattr(items, 'tolist'): # NumPy arrays
+			items = items.tolist()
+		elif not isinstance(items, list):
+			items = list(items)
+		i = 0
+		while i < len(items):
+			if self.per_item_updates():
+				for item in items[i:]:
+					self.update(item)
+				return
+			i += self.insert_chunk(items, i)
+			if self.room() <= 0:
+				self.compress()
+
+	# Adds items from position i on, at most room() of them, to level zero;
+	# returns the number of items taken
+	def insert_chunk(self, items, i):
+		chunk = items[i : i+self.room()]
+		self.compactors[0].extend(chunk)
+		self.N += len(chunk)
+		self.size += len(chunk)
+		return len(chunk)
+
+	# Changes the important quantiles (and J) of a running sketch; the
+	# capacities are re-derived at once, while the levels that no longer fit
+	# are compacted lazily, one compaction per update; the accuracy guarantees
+	# for the new quantiles apply from the switch onward
+	def set_important_quantiles(self, important_quantiles, constant_J=None):
+		if constant_J is None:
+			constant_J = self.J
+		check_importance(important_quantiles, constant_J)
+		self.important_quantiles = important_quantiles
+		self.J = constant_J
+		self.update_important_levels()
+		for c in self.compactors:
+			c.set_capacity_and_section_size()
+		self.draining = self.over_capacity()
+
+	# Adds the items summarized by another sketch of the same variant (built
+	# over a disjoint part of the input): the levels are concatenated, the
+	# capacities re-derived for the new height and N, and the full levels
+	# compacted until the sketch is within its capacity again
+	def merge(self, other):
+		if type(other) is not type(self):
+			raise ValueError("only sketches of the same variant can be merged")
+		# the levels are only compatible with the same error guarantee
+		if other.params() != self.params():
+			raise ValueError("only sketches with the same parameters can be merged")
+		while self.H() < other.H():
+			self.compactors.append(self.new_compactor())
+		for (c, items) in zip(self.compactors, other.compactors):
+			c.extend(items[:])
+		self.N += other.N
+		self.size = sum(len(c) for c in self.compactors)
+		self.restore_capacity()
+
+	# Re-derives the important levels and capacities and compacts the full
+	# levels one at a time
+	def restore_capacity(self):
+		self.update_important_levels()
+		for c in self.compactors:
+			c.set_capacity_and_section_size()
+		while self.over_capacity() and self.compact_full_level():
+			pass
+		self.draining = False
+
+	# Does one compaction of the lowest full level; returns False if no level is full
+	def compact_full_level(self):
+		for (h, compactor) in enumerate(self.compactors):
+			if compactor.is_full():
+				if h+1 == self.H():
+					self.grow()
+				else:
+					self.compactors[h+1].extend(compactor.normal_compaction())
+				return True
+		return False
+
+	# Do the compaction on level zero and possibly on higher levels
+	def compress(self):
+		# the footprint is largest right before the compaction
+		if self.memory_limit is not None:
+			self.check_memory_limit()
+		# levels over the changed capacities are compacted one at a time
+		if self.draining:
+			self.compact_full_level()
+			self.draining = self.over_capacity()
+			return
+		self.compress_levels()
+
+	# Approximate number of bytes held in memory by the stored items;
+	# with include_mapped=True also the files of memory-mapped levels
+	def memory_bytes(self, include_mapped=False):
+		total = sys.getsizeof(self.compactors)
+		for c in self.compactors:
+			total += c.memory_bytes()
+			if include_mapped:
+				total += c.mapped_bytes()
+		return total
+
+	# Item count, capacity, section size, number of compactions and bytes
+	# of every level
+	def level_stats(self):
+		return [c.stats() for c in self.compactors]
+
+	# Calls callback(sketch, bytes) when memory_bytes() exceeds limit bytes;
+	# it is checked before every compression and it fires again only after
+	# the footprint has dropped below the limit
+	def set_memory_limit(self, limit, callback):
+		self.memory_limit = limit
+		self.memory_callback = callback
+		self.over_memory_limit = False
+		if limit is not None:
+			self.check_memory_limit()
+
+	def check_memory_limit(self):
+		footprint = self.memory_bytes()
+		if footprint <= self.memory_limit:
+			self.over_memory_limit = False
+		elif not self.over_memory_limit:
+			self.over_memory_limit = True
+			self.memory_callback(self, footprint)
+
+	# Computes a list of items and their ranks
+	def ranks(self):
+		ranks_list = []
+		items_and_weights = []
+		for (h, items) in enumerate(self.compactors):
+			items_and_weights.extend( (item, 2**h) for item in items )
+		items_and_weights.sort()
+		cum_weight = 0
+		for (item, weight) in items_and_weights:
+			cum_weight += weight
+			ranks_list.append( (item, cum_weight) )
+		return ranks_list
+
+	# Generates items and their ranks by a k-way merge of the levels,
+	# which are sorted separately; consumers may stop early;
+	# with reverse=True it goes from the largest item down
+	def iter_ranks(self, reverse=False):
+		for c in self.compactors:
+			c.sort()
+		if not reverse:
+			levels = [zip(c, repeat(2**h)) for (h, c) in enumerate(self.compactors)]
+			cum_weight = 0
+			for (item, weight) in merge(*levels):
+				cum_weight += weight
+				yield (item, cum_weight)
+		else:
+			levels = [zip(reversed(c), repeat(2**h)) for (h, c) in enumerate(self.compactors)]
+			cum_weight = self.total_weight()
+			for (item, weight) in merge(*levels, reverse=True):
+				yield (item, cum_weight)
+				cum_weight -= weight
+
+	# Computes items and their ranks as two NumPy arrays; the sorted levels
+	# are concatenated and merged by a stable sort, which detects the runs
+	def ranks_array(self):
+		for c in self.compactors:
+			c.sort()
+		items = np.concatenate([c.as_array() for c in self.compactors])
+		weights = np.repeat(
+			np.array([2**h for h in range(self.H())], dtype=np.int64),
+			[len(c) for c in self.compactors]
+		)
+		order = np.argsort(items, kind='stable')
+		return (items[order], np.cumsum(weights[order]))
+
+	# Total weight of all stored items
+	def total_weight(self):
+		return sum(len(c) * 2**h for (h, c) in enumerate(self.compactors))
+
+	# Computes cummulative distribution function (as a list of items
+	# and their ranks expressed as a number in [0,1])
+	def cdf(self):
+		total_weight = self.total_weight()
+		return [(item, cum_weight / total_weight) for (item, cum_weight) in self.ranks()]
+
+	def iter_cdf(self):
+		total_weight = self.total_weight()
+		for (item, cum_weight) in self.iter_ranks():
+			yield (item, cum_weight / total_weight)
+
+	def cdf_array(self):
+		items, cum_weights = self.ranks_array()
+		return (items, cum_weights / cum_weights[-1])
+
+	# Approximate ranks of all the split points (which must be sorted) by one
+	# binary search per split point in each sorted level
+	def split_ranks(self, split_points):
+		if hasattr(split_points, 'tolist'): # NumPy arrays
+			split_points = split_points.tolist()
+		if any(a > b for (a, b) in zip(split_points, split_points[1:])):
+			raise ValueError("split points must be sorted")
+		ranks = [0] * len(split_points)
+		for (h, c) in enumerate(self.compactors):
+			c.sort()
+			weight = 2**h
+			for (i, count) in enumerate(c.split_ranks(split_points)):
+				ranks[i] += count * weight
+		return ranks
+
+	# Normalized ranks of the split points followed by 1
+	def get_cdf(self, split_points):
+		total_weight = self.total_weight()
+		return [r / total_weight for r in self.split_ranks(split_points)] + [1.0]
+
+	# Masses of the buckets (-inf, s_0], (s_0, s_1], ..., (s_m-1, inf)
+	# given by the split points s_0, ..., s_m-1
+	def get_pmf(self, split_points):
+		cdf = self.get_cdf(split_points)
+		return [cdf[0]] + [b - a for (a, b) in zip(cdf, cdf[1:])]
+
+	# Summary with k of the items and their ranks, denser at the tails and
+	# around the important quantiles (see quantileSummary)
+	def summary(self, k=200):
+		return Summary.from_ranks(self.ranks(), k, self.important_quantiles)
+
+	# Compares the distribution summarized by the other sketch to this one by
+	# one simultaneous merge of the sorted items of both, see Comparison;
+	# each normalized rank is off by at most epsilon times the rank (with
+	# probability 1-delta at any point), so the distances, and the differences
+	# relative to the smaller rank, are off by at most the sum of the
+	# epsilons; the relative difference ignores the items with a normalized
+	# rank below tail in either sketch, where it would be dominated by a few
+	# items
+	def compare(self, other, qs=(0.01, 0.25, 0.5, 0.75, 0.99), tail=0.001):
+		totals = (self.total_weight(), other.total_weight())
+		if 0 in totals:
+			raise ValueError("cannot compare an empty sketch")
+		qs = sorted(qs)
+		desired_ranks = ([q*self.N for q in qs], [q*other.N for q in qs])
+		quantiles = ([], [])
+		last = [None, None]
+		cdf = [0, 0]
+		(ks, ks_item, relative) = (0, None, 0)
+		tagged = merge(((item, 0, rank) for (item, rank) in self.iter_ranks()),
+			((item, 1, rank) for (item, rank) in other.iter_ranks()))
+		for (item, group) in groupby(tagged, key=itemgetter(0)):
+			for (_, side, rank) in group:
+				cdf[side] = rank / totals[side]
+				last[side] = item
+				found = quantiles[side]
+				while len(found) < len(qs) and rank >= desired_ranks[side][len(found)]:
+					found.append(item)
+			difference = abs(cdf[0] - cdf[1])
+			if difference > ks:
+				(ks, ks_item) = (difference, item)
+			scale = min(cdf)
+			if scale >= tail and scale > 0:
+				relative = max(relative, difference / scale)
+		# with sampling, the largest items may stand for the highest ranks
+		for side in (0, 1):
+			quantiles[side].extend([last[side]] * (len(qs) - len(quantiles[side])))
+		return Comparison(ks, ks_item, relative,
+			list(zip(qs, quantiles[0], quantiles[1])),
+			[b - a for (a, b) in zip(*quantiles)],
+			self.epsilon + other.epsilon, self.epsilon + other.epsilon)
+
+	# Arguments of the constructor that creates an empty sketch of the same kind
+	def params(self):
+		return {
+			"epsilon": self.epsilon, "delta": self.delta,
+			"important_quantiles": sorted(self.important_quantiles), "constant_J": self.J
+		}
+
+	# JSON-friendly form of the sketch: the parameters, N and the items and
+	# compaction schedule of every level
+	def to_dict(self):
+		return {
+			"variant": self.variant, "params": self.params(), "N": self.N,
+			"levels": [{"items": c[:], "state": c.state, "num_compactions": c.num_compactions}
+				for c in self.compactors]
+		}
+
+	# Rebuilds a sketch from to_dict(); the random choices of the compactors
+	# are not stored and start afresh
+	@classmethod
+	def from_dict(cls, d):
+		if d["variant"] != cls.variant:
+			raise ValueError(f"cannot load a {d['variant']} sketch as {cls.variant}")
+		params = dict(d["params"])
+		params["important_quantiles"] = set(params["important_quantiles"])
+		sketch = cls(**params)
+		for (h, level) in enumerate(d["levels"]):
+			if h == sketch.H():
+				sketch.compactors.append(sketch.new_compactor())
+			c = sketch.compactors[h]
+			c.extend(level["items"])
+			c.state = level["state"]
+			c.num_compactions = level["num_compactions"]
+		sketch.N = d["N"]
+		sketch.size = sum(len(c) for c in sketch.compactors)
+		sketch.restore_capacity()
+		return sketch
+
+	# Caches the answers of quantile() and rank() until N grows by more than
+	# the tolerance times the rank of the answer (the rank returned, or q
+	# times the N of quantile(q)); the new items move a rank by at most their
+	# number, so a cached answer is off by at most a tolerance fraction of its
+	# own rank more than a fresh one, as in the relative guarantee of the
+	# sketch; tolerance None turns the cache off
+	def set_query_cache(self, tolerance):
+		if tolerance is not None and tolerance < 0:
+			raise ValueError("tolerance must be non-negative")
+		self.query_tolerance = tolerance
+		self.query_cache = {}
+		self.query_cache_hits = 0
+		self.query_cache_misses = 0
+
+	def cached_query(self, function, argument, rank_of):
+		key = (function.__name__, argument)
+		if key in self.query_cache:
+			(N, answer, rank) = self.query_cache[key]
+			if self.N - N <= self.query_tolerance * rank:
+				self.query_cache_hits += 1
+				return answer
+		self.query_cache_misses += 1
+		if len(self.query_cache) >= QUERY_CACHE_SIZE:
+			self.query_cache = {}
+		answer = function(argument)
+		self.query_cache[key] = (self.N, answer, rank_of(answer))
+		return answer
+
+	# Returns an approximate rank of value
+	def rank(self, value):
+		if self.query_tolerance is not None:
+			return self.cached_query(self.compute_rank, value, lambda rank: rank)
+		return self.compute_rank(value)
+
+	def compute_rank(self, value):
+		return sum(c.rank(value)*2**h for (h, c) in enumerate(self.compactors))
+
+	# Returns an input item which is approx. q-quantile
+	# (i.e. has rank approx. q*self.N)
+	def quantile(self, q):
+		assert (q >= 0 and q <= 1), f"parameter q must be in [0, 1], but q = {q}"
+		if self.query_tolerance is not None:
+			return self.cached_query(self.compute_quantile, q, lambda item: q * self.N)
+		return self.compute_quantile(q)
+
+	def compute_quantile(self, q):
+		desired_rank = q*self.N
+		# the merge stops at the first item with large enough rank,
+		# starting from the closer end
+		item = None
+		if q <= 0.5:
+			for (item, rank) in self.iter_ranks():
+				if desired_rank <= rank:
+					break
+		else:
+			for (candidate, rank) in self.iter_ranks(reverse=True):
+				if desired_rank > rank and item is not None:
+					break
+				item = candidate
+		# with sampling, up to sampler_block items may be still unaccounted
+		# for, then the largest item is returned
+		return item
+
+# Compactor shared by both variants; they supply set_capacity, compact and
+# the number of sections init_sections
+class RelativeCompactorCore(list):
+	# Attributes outside of the state logged by checkpointLog (references and
+	# the items); classes storing the items differently declare their own
+	unlogged = ('sketch', 'journal', 'mark')
+
+	def __init__(self, sketch):
+		self.num_compactions = 0 # Number of compaction operations performed
+		self.state = 0 # State of the deterministic compaction schedule
+		self.sketch = sketch
+		self.h = sketch.H() # height (level) of the compactor
+		self.capacity = None
+		self.section_size = None
+		# Changes since the last checkpoint, None when not logged (see checkpointLog)
+		self.journal = None
+		# Number of items already covered by the journal
+		self.mark = 0
+
+	def rank(self, value):
+		return sum(1 for v in self if v <= value)
+
+	def as_array(self):
+		return np.array(self)
+
+	# Numbers of items not larger than the sorted split points; the
+	# compactor must be sorted
+	def split_ranks(self, split_points):
+		return [bisect_right(self, x) for x in split_points]
+
+	# Bytes of the list and of its items, which are assumed to be of one type
+	def memory_bytes(self):
+		if len(self) == 0:
+			return sys.getsizeof(self)
+		return sys.getsizeof(self) + len(self) * sys.getsizeof(self[0])
+
+	# Bytes stored outside of the process memory
+	def mapped_bytes(self):
+		return 0
+
+	def stats(self):
+		return {
+			"h": self.h, "items": len(self), "capacity": self.capacity,
+			"section_size": self.section_size, "num_compactions": self.num_compactions,
+			"bytes": self.memory_bytes(), "mapped_bytes": self.mapped_bytes()
+		}
+
+	def sort(self):
+		if self.journal is not None:
+			self.note_appended()
+			self.journal.append(('sort',))
+		super().sort()
+
+	# Records the items appended since the last change in the journal
+	def note_appended(self):
+		if len(self) > self.mark:
+			self.journal.append(('extend', self[self.mark:]))
+		self.mark = len(self)
+
+	def note_deleted(self, start, end):
+		self.journal.append(('delete', start, end))
+		self.mark = len(self)
+
+	def is_full(self):
+		return len(self) >= self.capacity
+
+	def reset_compaction_schedule(self):
+		self.state = 0
+		self.set_capacity_and_section_size()
+
+	def set_section_size(self):
+		self.section_size = int(
+			self.capacity /
+			( 2 * self.init_sections * log(2 + self.num_compactions, 2) )
+		)
+
+	def set_capacity_and_section_size(self):
+		self.set_capacity()
+		self.set_section_size()
+
+	# Chooses a scaling factor by the distance to the closest important level
+	def scale(self):
+		# distance from the closest important level
+		if len(self.sketch.important_levels) > 0:
+			dist = min([abs(self.h-l) for l in self.sketch.important_levels])
+		else:
+			dist = 0
+
+		# choose the scaling factor (based on J parameter)
+		if dist == 0:
+			scale = 1
+		elif dist == 1:
+			scale = 1.5**self.sketch.J
+		else:
+			scale = dist**self.sketch.J
+
+		return min(scale, self.sketch.H())
+
+	# Counts the number of protected items based on the compaction schedule
+	def count_protected(self):
+		right_part = self.capacity // 2
+		rest = len(self) - self.capacity
+		section_size = self.section_size
+
+		# If the section size is too small we do not use the schedule
+		if section_size < SMALLEST_MEANINGFUL_SECTION_SIZE:
+			compacted = right_part + rest
+		else:
+			sections_to_compact = trailing_ones_binary(self.state) + 1
+			self.state += 1
+			right_compacted = sections_to_compact * section_size
+			# schedule overflow
+			if right_compacted >= right_part:
+				right_compacted = right_part
+				self.reset_compaction_schedule()
+			compacted = right_compacted + rest
+		compacted += compacted % 2
+		return len(self) - compacted
+
+	# Compacts everything except for the left half and resets the schedule
+	def full_compaction(self):
+		protected = self.capacity // 2 + 1
+		protected -= (len(self)-protected) % 2
+		self.reset_compaction_schedule()
+		return self.compact(protected)
+
+	# Standard compaction by the schedule (only called on a full compactor)
+	def normal_compaction(self):
+		return self.compact(self.count_protected())
+
+# AUXILIARY FUNCTIONS
+def check_importance(important_quantiles, constant_J):
+	if constant_J < 0:
+		raise ValueError("J must be non-negative")
+	if not all(x >= 0 and x <= 1 for x in important_quantiles):
+		raise ValueError("All important quantiles must be between 0 and 1")
+	if constant_J != 0 and important_quantiles == set():
+		raise ValueError("with no important quentiles, j must equal 0")
+
+# The lowest zero bit of n is the only bit set in both n+1 and ~n
+def trailing_ones_binary(n):
+	return ((n + 1) & ~n).bit_length() - 1
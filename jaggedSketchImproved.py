@@ -2,80 +2,200 @@
 
 from random import random
 from math import log
+from itertools import compress
+from bisect import bisect_left
+from collections import namedtuple
+# the helpers and constants are re-exported for the existing imports
+from jaggedSketchCore import (JaggedSketchCore, RelativeCompactorCore,
+	check_importance, trailing_ones_binary, SMALLEST_MEANINGFUL_SECTION_SIZE, np)
 
 # CONSTANTS
-SMALLEST_MEANINGFUL_SECTION_SIZE = 4
 INIT_SECTIONS = 1.5
+# Only items above this quantile are sampled (their ranks are large enough)
+SAMPLER_QUANTILE = 0.5
+# Number of items update_many classifies for the sampler at once
+SAMPLER_WINDOW = 1 << 16
+# Lowest sampling level used by update_many; below it the sampled items are
+# inserted to level zero, which is faster than the classification
+SAMPLER_BULK_LEVEL = 3
 
-class JaggedSketch:
-	def __init__(self, epsilon=0.01, delta=0.01, important_quantiles={0}, 
-			constant_J=0.5, improvement_for_high_ranks=True):
-		if epsilon <= 0 or epsilon > 1:
-			raise ValueError("epsilon must be between 0 and 1")
-		if delta <= 0 or delta > 0.5:
-			raise ValueError("delta must be between 0 and 0.5")
-		if constant_J < 0:
-			raise ValueError("J must be non-negative")
-		if not all(x >= 0 and x <= 1 for x in important_quantiles):
-			raise ValueError("All important quantiles must be between 0 and 1")
-		if constant_J != 0 and important_quantiles == set():
-			raise ValueError("with no important quentiles, j must equal 0")
-		# Set of ranks with higher accuracy given as an imput to the quantile function
-		self.important_quantiles = important_quantiles
-		# Gives importance of ranks in Q; 
-  		# J=0 means all ranks have the same importance
-		self.J = constant_J
-		# Relative error for the desired rank in Q (quarantee from the theory)
-		self.epsilon = epsilon
+# Sampled items of a window of the input of update_many (see plan_sampler)
+SamplerPlan = namedtuple('SamplerPlan', ['key', 'start', 'stop', 'count', 'block', 'picks',
+	'representatives', 'below_items', 'cum_below', 'added', 'positions', 'completions'])
+
+# Compresses lazily (only when the total size reaches the total capacity),
+# finds the important levels by the current quantiles and randomizes the
+# compactions by an offset and a shift (see jaggedSketchCore for the rest)
+class JaggedSketch(JaggedSketchCore):
+	variant = 'improved'
+
+	def __init__(self, epsilon=0.01, delta=0.01, important_quantiles={0},
+			constant_J=0.5, improvement_for_high_ranks=True, sampling=False):
 		# Error improvement for high ranks
 		self.improvement_for_high_ranks = improvement_for_high_ranks
-		# Delta is the probability of error larger than epsilon for given query
-		self.probability_constant = log(1/delta)**0.5		
-		# Size of the input summarized
-		self.N = 0
-		# Current number of saved items
-		self.size = 0
-		# Sum of capacities of all compactors
-		self.capacity = 0
-		# Levels corresponding to important quantiles
-		self.important_levels = set()
-		self.compactors = []
-		self.compactors.append(RelativeCompactor(self))
-		self.compactors[0].set_capacity_and_section_size()
-	
-	def H(self):
-		return len(self.compactors)
+		# Sampler in front of level zero; blocks of sampler_block = 2**sampler_level
+		# items above sampler_threshold are replaced by one random representative
+		# inserted directly to the level sampler_level
+		self.sampling = sampling
+		self.sampler_level = 0
+		self.sampler_next_level = 0
+		self.sampler_block = 1
+		self.sampler_pick = 1
+		self.sampler_threshold = None
+		self.sampler_count = 0
+		self.sampler_candidate = None
+		self.sampler_plan = None
+		super().__init__(epsilon, delta, important_quantiles, constant_J)
+
+	# Creates the compactor for the next level
+	def new_compactor(self):
+		return RelativeCompactor(self)
+
+	def params(self):
+		return dict(super().params(),
+			improvement_for_high_ranks=self.improvement_for_high_ranks, sampling=self.sampling)
 
-	# Adds new compactor to the sketch
 	def grow(self):
-		# Add a new compactor
-		self.compactors.append(RelativeCompactor(self))
-		self.compactors[-1].set_capacity_and_section_size()
-		
-		# Do the full compaction for all compactors
-		for (h, compactor) in enumerate(self.compactors[:self.H()-1]):
-			self.compactors[h+1].extend(compactor.full_compaction())
-		while self.compactors[-1].is_full():
-			self.compactors.append(RelativeCompactor(self))
-			self.compactors[-1].set_capacity_and_section_size()
-			self.compactors[-1].extend(self.compactors[-2].full_compaction())
-		
-		# Update all the parameters
-		self.update_important_levels()
-		for c in self.compactors:
-			c.set_capacity_and_section_size()
-			
+		super().grow()
+		if self.sampling:
+			self.tune_sampler()
+
 	# Adds new item to the skech
 	def update(self, item):
-		self.compactors[0].append(item)
 		self.N += 1
+		if self.sampler_level > 0 and item >= self.sampler_threshold:
+			self.sampler_count += 1
+			if self.sampler_count == self.sampler_pick:
+				self.sampler_candidate = item
+			if self.sampler_count == self.sampler_block:
+				self.insert_sample()
+			return
+		self.compactors[0].append(item)
+		self.size += 1
+		if self.size >= self.capacity:
+			self.compress()
+
+	def per_item_updates(self):
+		return self.draining or (self.sampler_level >= SAMPLER_BULK_LEVEL and np is None)
+
+	def update_many(self, items):
+		self.sampler_plan = None
+		try:
+			super().update_many(items)
+		finally:
+			self.sampler_plan = None
+
+	# Bulk form of update() for the items from position i on: the items
+	# below the threshold go to level zero and the representatives of the
+	# completed blocks to the sampling level, both taken from the plan of the
+	# window (see plan_sampler); the items are taken up to the one with which
+	# the size reaches the capacity, or up to the first completed block if the
+	# sampling level changes after it
+	def insert_chunk(self, items, i):
+		if self.sampler_level < SAMPLER_BULK_LEVEL:
+			return super().insert_chunk(items, i)
+		plan = self.sampler_plan
+		if plan is None or i >= plan.stop or plan.key != (self.sampler_threshold, self.sampler_level) or \
+				plan.picks[bisect_left(plan.completions, i - plan.start)] != self.sampler_pick:
+			plan = self.sampler_plan = self.plan_sampler(items, i)
+		o = i - plan.start
+		(added, below) = (plan.added[o-1], int(plan.cum_below[o-1])) if o > 0 else (0, 0)
+		k = bisect_left(plan.completions, o) # blocks completed before
+		end = min(bisect_left(plan.added, added + self.room()) + 1, len(plan.added))
+		if self.sampler_next_level != self.sampler_level and k < len(plan.completions):
+			end = min(end, plan.completions[k] + 1)
+		completed = bisect_left(plan.completions, end)
+		below_end = int(plan.cum_below[end-1])
+
+		self.compactors[0].extend(plan.below_items[below:below_end])
+		self.compactors[self.sampler_level].extend(plan.representatives[k:completed])
+		if completed > k:
+			if self.sampler_next_level != self.sampler_level:
+				self.start_sampler_block(self.sampler_next_level)
+			else:
+				self.sampler_pick = plan.picks[completed]
+		self.sampler_count = plan.count + (end - below_end) - completed * plan.block
+		if self.sampler_count < self.sampler_pick:
+			self.sampler_candidate = None
+		elif completed > 0 or self.sampler_pick > plan.count: # else chosen before the plan
+			self.sampler_candidate = items[int(plan.positions[completed * plan.block + self.sampler_pick - plan.count - 1])]
+		self.N += end - o
+		self.size += below_end - below + completed - k
+		return end - o
+
+	# Plan of the sampler for the next SAMPLER_WINDOW items from position i:
+	# the items below the threshold and their running count, the positions
+	# of the sampled items, where the blocks are completed, the running count
+	# of the items added to the sketch, the picks of the current block and of
+	# the following ones (drawn here instead of at the block starts) and the
+	# representatives of the blocks; valid while the threshold, the level and
+	# the pick of the current block stay the same
+	def plan_sampler(self, items, i):
+		window = items[i : i+SAMPLER_WINDOW]
+		values = np.asarray(window)
+		if values.dtype.kind in 'iu': # exact comparisons of integers in bulk
+			below = values < self.sampler_threshold
+		else:
+			below = np.array([not x >= self.sampler_threshold for x in window], dtype=bool)
+		(count, block) = (self.sampler_count, self.sampler_block)
+		cum_below = np.cumsum(below)
+		# the number of sampled items is the position minus the items below
+		completes = ~below & ((count + np.arange(1, len(window) + 1) - cum_below) % block == 0)
+		completions = np.flatnonzero(completes)
+		positions = np.flatnonzero(~below) + i
+		picks = np.empty(len(completions) + 1, dtype=np.int64)
+		picks[0] = self.sampler_pick
+		picks[1:] = [int(random() * block) + 1 for _ in range(len(completions))]
+		# the representative of block b is the sampled item number b*block + pick
+		# counted from the start of the current block, count of them before i
+		at = block * np.arange(len(completions)) + picks[:-1] - count - 1
+		representatives = [self.sampler_candidate] if len(at) and at[0] < 0 else []
+		representatives.extend(map(items.__getitem__, positions[at[at >= 0]].tolist()))
+		return SamplerPlan(
+			key=(self.sampler_threshold, self.sampler_level), start=i, stop=i + len(window),
+			count=count, block=block, picks=picks.tolist(), representatives=representatives,
+			below_items=list(compress(window, below.tolist())), cum_below=cum_below,
+			added=np.cumsum(below | completes).tolist(), positions=positions, completions=completions.tolist()
+		)
+
+	def room(self):
+		return self.capacity - self.size
+
+	def over_capacity(self):
+		return self.size >= self.capacity
+
+	# Inserts the representative of a complete block of sampled items
+	def insert_sample(self):
+		self.compactors[self.sampler_level].append(self.sampler_candidate)
+		self.sampler_count = 0
+		self.sampler_candidate = None
+		# the level may only change between two blocks
+		self.start_sampler_block(self.sampler_next_level)
 		self.size += 1
 		if self.size >= self.capacity:
 			self.compress()
-		assert self.size < self.capacity
-	
+
+	# The representative is the item at a position chosen uniformly at random
+	def start_sampler_block(self, level):
+		self.sampler_level = level
+		self.sampler_block = 2**level
+		self.sampler_pick = int(random() * self.sampler_block) + 1
+
+	# Chooses the sampling level by the current N; sampled items have rank
+	# at least r = SAMPLER_QUANTILE*N, and the standard deviation of the
+	# sampling error at rank r is about (r * 2**level)**0.5 / 2, which is
+	# at most epsilon*r / (2*probability_constant) by the choice below
+	def tune_sampler(self):
+		r = SAMPLER_QUANTILE * self.N
+		bound = self.epsilon**2 * r / self.probability_constant**2
+		level = min(int(log(bound, 2)) if bound >= 2 else 0, self.H() - 1)
+		self.sampler_threshold = self.compute_quantile(SAMPLER_QUANTILE)
+		self.sampler_next_level = level
+		if self.sampler_count == 0:
+			self.start_sampler_block(level)
+
 	# Do the compaction on level zero and possibly on higher levels
-	def compress(self):
+	def compress_levels(self):
 		for (h, compactor) in enumerate(self.compactors):
 			if compactor.is_full():
 				if h+1 == self.H():
@@ -85,15 +205,14 @@ class JaggedSketch:
 				# Be lazy and do not continue under capacity
 				if self.size < self.capacity:
 					return
-				
-	
+
 	# Find the right levels corresponding to the quantiles
 	# We assume that when this function is called, all compactors are sorted
 	def update_important_levels(self):
 		self.important_levels.clear()
 		for q in self.important_quantiles:
-			x = self.quantile(q) # item with appropriate quantile
-			
+			x = self.compute_quantile(q) # item with appropriate quantile (never cached)
+
 			# binary seach for the right level
 			i = 0
 			j = self.H() - 1
@@ -107,174 +226,51 @@ class JaggedSketch:
 
 			# save the calculated level
 			self.important_levels.add(i)
-	
-	# Computes a list of items and their ranks
-	def ranks(self):
-		ranks_list = []
-		items_and_weights = []
-		for (h, items) in enumerate(self.compactors):
-			items_and_weights.extend( (item, 2**h) for item in items )
-		items_and_weights.sort()
-		cum_weight = 0
-		for (item, weight) in items_and_weights:
-			cum_weight += weight
-			ranks_list.append( (item, cum_weight) )
-		return ranks_list
-
-	# Computes cummulative distribution function (as a list of items 
-	# and their ranks expressed as a number in [0,1])
-	def cdf(self):
-		cdf = []
-		rank_list = self.ranks()
-		_, total_weight = rank_list[-1]
-		for (item, cum_weight) in rank_list:
-			cdf.append( (item, cum_weight / total_weight) )
-		return cdf
 
-	# Returns an approximate rank of value
-	def rank(self, value):
-		return sum(c.rank(value)*2**h for (h, c) in enumerate(self.compactors))
-		
+class RelativeCompactor(RelativeCompactorCore):
+	init_sections = INIT_SECTIONS
 
-	# Returns an input item which is approx. q-quantile 
- 	# (i.e. has rank approx. q*self.N)
-	def quantile(self, q):
-		assert (q >= 0 and q <= 1), f"parameter q must be in [0, 1], but q = {q}"
-		desired_rank = q*self.N
-		ranks = self.ranks()
-		i = 0
-		j = len(ranks)
-		while i < j:
-			m = (i + j) // 2
-			(item, rank) = ranks[m]
-			if desired_rank > rank:
-				i = m + 1
-			else: j = m
-		(item, rank) = ranks[i]
-		return item
-
-class RelativeCompactor(list):
 	def __init__(self, sketch):
-		self.num_compactions = 0 # Number of compaction operations performed
-		self.state = 0 # State of the deterministic compaction schedule
+		super().__init__(sketch)
 		self.offset = 0 # Indicator for taking even or odd items
 		self.shift = 0 # Indicator for shifting the compacted part by one item
-		self.sketch = sketch
-		self.h = sketch.H() # height (level) of the compactor
-		self.capacity = None
-		self.section_size = None
-		
-	def rank(self, value):
-		return sum(1 for v in self if v <= value)
 
-	def is_full(self):
-		return len(self) >= self.capacity
-	
-	def reset_compaction_schedule(self):
-		self.state = 0
-		self.set_capacity_and_section_size()
-	
 	def set_capacity(self):
 		old_capacity = self.capacity if self.capacity != None else 0
 		if self.sketch.improvement_for_high_ranks:
-			self.capacity = int(self.sketch.probability_constant * 
+			self.capacity = int(self.sketch.probability_constant *
 				self.sketch.H()**(0.5 + min(1, self.sketch.J)) /
 				(self.scale() * self.sketch.epsilon)
 			)
 		else:
-			self.capacity = int(self.sketch.probability_constant * 
-				self.sketch.H()**min(1, self.sketch.J) * 
+			self.capacity = int(self.sketch.probability_constant *
+				self.sketch.H()**min(1, self.sketch.J) *
 				log(2 + self.num_compactions, 2)**0.5 /
 				(self.scale() * self.sketch.epsilon)
 			)
 		self.sketch.capacity += self.capacity - old_capacity
-		
-	def set_section_size(self):
-		self.section_size = int(
-			self.capacity / 
-			( 2 * INIT_SECTIONS * log(2 + self.num_compactions, 2) )
-		)
-	
-	def set_capacity_and_section_size(self):
-		self.set_capacity()
-		self.set_section_size()
-
-	# Chooses a scaling factor by the distance to the closest important level
-	def scale(self):
-		# distance from the closest important level
-		if len(self.sketch.important_levels) > 0:
-			dist = min([abs(self.h-l) for l in self.sketch.important_levels])
-		else:
-			dist = 0
-		
-		# choose the scaling factor (based on J parameter)
-		if dist == 0: 
-			scale = 1
-		elif dist == 1: 
-			scale = 1.5**self.sketch.J
-		else: 
-			scale = dist**self.sketch.J
-		
-		return min(scale, self.sketch.H())
-	
-	# Counts the number of protected items based on the compaction schedule
-	def count_protected(self):
-		right_part = self.capacity // 2
-		rest = len(self) - self.capacity
-		section_size = self.section_size
-		
-		# If the section size is too small we do not use the schedule
-		if section_size < SMALLEST_MEANINGFUL_SECTION_SIZE: 
-			compacted = right_part + rest
-		else: 
-			sections_to_compact = trailing_ones_binary(self.state) + 1
-			self.state += 1
-			right_compacted = sections_to_compact * section_size
-			# schedule overflow
-			if right_compacted >= right_part:
-				right_compacted = right_part
-				self.reset_compaction_schedule()
-			compacted = right_compacted + rest
-		compacted += compacted % 2
-		return len(self) - compacted
-	
-	# Compacts everything except for the left half and resets the schedule
-	def full_compaction(self):
-		protected = self.capacity // 2 + 1
-		protected -= (len(self)-protected) % 2
-		self.reset_compaction_schedule()
-		for x in self.compact(protected):
-			yield x
 
-	# Standard compaction by the schedule	
-	def normal_compaction(self):
-		assert self.is_full()
-		for x in self.compact(self.count_protected()):
-			yield x
-	
-	# Compacts all items exept the smallest "protected"
-	def compact(self, protected):
-		assert len(self[protected: ]) % 2 == 0
-		self.sort() 
-		
-		# Set the random offset and random shift independently
-		# each choice every other time
+	# Set the random offset and random shift independently
+	# each choice every other time
+	def choose_offset_and_shift(self):
 		if self.num_compactions % 2 == 1:
 			self.offset = 1 - self.offset
 			self.shift = int(random() < 0.5)
 		else:
 			self.offset = int(random() < 0.5)
 			self.shift = 1 - self.shift
-		
-		# yield half of non-protected and delete all of them from self
-		for i in range(protected + self.offset - self.shift, len(self) - self.shift, 2):
-			yield self[i] # yield selected items
-		self.sketch.size -= len(self[protected: ]) // 2
-		del self[protected - self.shift : len(self) - self.shift]
-		self.num_compactions += 1
-		assert not self.is_full()
 
-# AUXILIARY FUNCTIONS
-def trailing_ones_binary(n):
-	s = str("{0:b}".format(n))
-	return len(s)-len(s.rstrip('1'))
\ No newline at end of file
+	# Compacts all items exept the smallest "protected" (their number is even)
+	# and returns the selected half of them as a single slice
+	def compact(self, protected):
+		self.sort()
+		self.choose_offset_and_shift()
+		(start, end) = (protected - self.shift, len(self) - self.shift)
+		selected = self[start + self.offset : end : 2]
+		# a full compaction may find fewer items than protected (none deleted)
+		self.sketch.size -= max(0, end - start) - len(selected)
+		del self[start : end]
+		if self.journal is not None:
+			self.note_deleted(start, end)
+		self.num_compactions += 1
+		return selected
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+from jaggedSketchImproved import JaggedSketch
+import argparse, sys, io, mmap, os, pickle
+import numpy as np
+
+DTYPES = {'int64': np.int64, 'float64': np.float64}
+# Text is parsed in blocks of this many bytes
+CHUNK_BYTES = 1 << 24
+
+# Reads a file in large blocks, each ending at a line boundary
+def split_lines(file, chunk_bytes=CHUNK_BYTES):
+	rest = b''
+	while True:
+		data = file.read(chunk_bytes)
+		if not data:
+			break
+		data = rest + data
+		cut = data.rfind(b'\n') + 1
+		rest = data[cut:]
+		if data[:cut].strip():
+			yield data[:cut]
+	if rest.strip():
+		yield rest
+
+# Yields NumPy arrays parsed from newline-delimited numbers
+def read_text(file, dtype, chunk_bytes=CHUNK_BYTES):
+	for block in split_lines(file, chunk_bytes):
+		yield np.array(block.split(), dtype=dtype)
+
+# Yields NumPy arrays with one column of a CSV file
+def read_csv(file, dtype, column, delimiter=',', skip=0, chunk_bytes=CHUNK_BYTES):
+	for _ in range(skip): # header lines
+		file.readline()
+	for block in split_lines(file, chunk_bytes):
+		yield np.loadtxt(io.BytesIO(block), dtype=dtype,
+			delimiter=delimiter, usecols=column, ndmin=1)
+
+# Yields NumPy arrays of raw binary numbers in native byte order
+def read_binary(file, dtype, chunk_items=1<<20):
+	itemsize = np.dtype(dtype).itemsize
+	rest = b''
+	while True:
+		data = file.read(chunk_items * itemsize)
+		if not data:
+			break
+		data = rest + data
+		cut = len(data) - len(data) % itemsize
+		rest = data[cut:]
+		yield np.frombuffer(data[:cut], dtype=dtype)
+	if rest:
+		raise ValueError(f"input length is not a multiple of {itemsize} bytes")
+
+# Yields slices of a memory-mapped binary file without reading it at once
+def read_mmap(path, dtype, chunk_items=1<<20):
+	with open(path, 'rb') as file:
+		# an empty file cannot be mapped (and has no items)
+		if os.fstat(file.fileno()).st_size == 0:
+			return
+		with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mem:
+			itemsize = np.dtype(dtype).itemsize
+			if len(mem) % itemsize != 0:
+				raise ValueError(f"input length is not a multiple of {itemsize} bytes")
+			array = np.frombuffer(mem, dtype=dtype)
+			for i in range(0, len(array), chunk_items):
+				# copy so that the map can be closed afterwards
+				yield np.array(array[i : i+chunk_items])
+			del array
+
+def read_chunks(args, dtype):
+	if args.format == 'binary' and args.mmap:
+		if args.input == '-':
+			raise ValueError("--mmap needs a file path, not stdin")
+		yield from read_mmap(args.input, dtype)
+		return
+	file = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+	try:
+		if args.format == 'text':
+			yield from read_text(file, dtype)
+		elif args.format == 'csv':
+			yield from read_csv(file, dtype, args.column, args.delimiter, args.skip)
+		else:
+			yield from read_binary(file, dtype)
+	finally:
+		if file is not sys.stdin.buffer:
+			file.close()
+
+def main():
+	parser = argparse.ArgumentParser(description=
+		'Builds a Jagged Sketch from numbers in a file or on stdin.'
+	)
+	parser.add_argument(
+		'input', type=str, nargs='?', default='-',
+		help='the input file, "-" for stdin (default)'
+	)
+	parser.add_argument(
+		'-format', type=str, default='text', choices=['text', 'csv', 'binary'],
+		help='newline-delimited text, a CSV column or raw binary numbers'
+	)
+	parser.add_argument(
+		'-dtype', type=str, default='float64', choices=list(DTYPES),
+		help='the type of the numbers'
+	)
+	parser.add_argument(
+		'-column', type=int, default=0,
+		help='the CSV column to read'
+	)
+	parser.add_argument(
+		'-delimiter', type=str, default=',',
+		help='the CSV delimiter'
+	)
+	parser.add_argument(
+		'-skip', type=int, default=0,
+		help='the number of CSV header lines to skip'
+	)
+	parser.add_argument(
+		'--mmap', action='store_true',
+		help='memory-map a binary input file instead of reading it'
+	)
+	parser.add_argument(
+		'-epsilon', type=float, default=0.01,
+	)
+	parser.add_argument(
+		'-delta', type=float, default=0.01,
+	)
+	parser.add_argument(
+		'-q', type=float, default=[], action='append',
+		help='important quantiles, default = {0}'
+	)
+	parser.add_argument(
+		'-j', type=float, default=0.5,
+		help='the constant J from theory'
+	)
+	parser.add_argument(
+		'--no-improvement', action='store_true',
+		help='turns of the improvement for high ranks'
+	)
+	parser.add_argument(
+		'-quantile', type=float, default=[], action='append',
+		help='print the approximate q-quantile (can be repeated)'
+	)
+	parser.add_argument(
+		'-rank', type=float, default=[], action='append',
+		help='print the approximate rank of a value (can be repeated)'
+	)
+	parser.add_argument(
+		'--cdf', action='store_true',
+		help='print the whole approximate CDF'
+	)
+	parser.add_argument(
+		'-save', type=str, default='',
+		help='write the pickled sketch to this file'
+	)
+	args = parser.parse_args()
+
+	sketch = JaggedSketch(epsilon=args.epsilon, delta=args.delta,
+		important_quantiles=set(args.q) if args.q != [] else {0},
+		constant_J=args.j, improvement_for_high_ranks=not args.no_improvement
+	)
+	for chunk in read_chunks(args, DTYPES[args.dtype]):
+		sketch.update_many(chunk)
+	if sketch.N == 0:
+		exit("no input items")
+
+	for q in args.quantile:
+		print(f"quantile {q}: {sketch.quantile(q)}")
+	for value in args.rank:
+		print(f"rank {value}: {sketch.rank(value)}")
+	if args.cdf:
+		for (item, fraction) in sketch.cdf():
+			print(f"{item}\t{fraction}")
+	if args.save != '':
+		with open(args.save, mode='wb') as file:
+			pickle.dump(sketch, file)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+import jaggedSketchImproved, jaggedSketchSimple
+import numpy as np
+
+# CONSTANTS
+# Initial number of items per replica reserved for a level
+INIT_LOCKSTEP_ITEMS = 1024
+
+# R independent replicas of a Jagged Sketch built over the same stream in
+# one pass; all replicas have the same number of items on every level (the
+# compactions always remove the same number of items), so a level is one
+# (R, length) array and a compaction is a partial sort of all rows followed
+# by strided selections with independent random offsets per replica;
+# the usual queries (rank, quantile, ...) answer for replica 0
+class LockstepSketch:
+	def __init__(self, replicas, *args, dtype='float64', seed=None, **kwargs):
+		if replicas < 1:
+			raise ValueError("there must be at least one replica")
+		self.replicas = replicas
+		# Items are stored with this NumPy type
+		self.dtype = np.dtype(dtype)
+		self.rng = np.random.default_rng(seed)
+		super().__init__(*args, **kwargs)
+
+	# Sorted items of every replica and their ranks as two (R, size) arrays
+	def replica_ranks(self):
+		for c in self.compactors:
+			c.sort()
+		items = np.concatenate([c.rows() for c in self.compactors], axis=1)
+		weights = np.repeat(
+			np.array([2**h for h in range(self.H())], dtype=np.int64),
+			[len(c) for c in self.compactors]
+		)
+		order = np.argsort(items, axis=1, kind='stable')
+		return (np.take_along_axis(items, order, axis=1), np.cumsum(weights[order], axis=1))
+
+	# The same as ranks() of every replica, e.g. for Sampling in JSITest/JSSTest
+	def replica_rank_lists(self):
+		(items, cum_weights) = self.replica_ranks()
+		return [list(zip(x.tolist(), r.tolist())) for (x, r) in zip(items, cum_weights)]
+
+# The simple variant; its important levels depend only on N, so the
+# replicas are fully independent
+class LockstepSimpleSketch(LockstepSketch, jaggedSketchSimple.JaggedSketch):
+	def new_compactor(self):
+		return LockstepSimpleLevel(self)
+
+# The improved variant (without sampling); its important levels are derived
+# from the items of replica 0 and shared by all replicas, so that they keep
+# the same capacities
+class LockstepImprovedSketch(LockstepSketch, jaggedSketchImproved.JaggedSketch):
+	def __init__(self, replicas, *args, **kwargs):
+		if kwargs.get('sampling'):
+			raise ValueError("sampling is not supported by the lockstep sketch")
+		super().__init__(replicas, *args, **kwargs)
+
+	def new_compactor(self):
+		return LockstepImprovedLevel(self)
+
+# Storage of one level of all replicas; the list interface used by the
+# sketch (iteration, indexing, rank, ...) shows the items of replica 0,
+# extend() accepts either items common to all replicas or an (R, k) array
+class LockstepStorage:
+	unlogged = ('data', 'length')
+
+	def __init__(self, sketch):
+		super().__init__(sketch)
+		self.length = 0
+		self.data = np.empty((sketch.replicas, INIT_LOCKSTEP_ITEMS), dtype=sketch.dtype)
+
+	def reserve(self, n):
+		if self.data.shape[1] >= n:
+			return
+		data = np.empty((self.data.shape[0], max(n, 2*self.data.shape[1])), dtype=self.data.dtype)
+		data[:, :self.length] = self.data[:, :self.length]
+		self.data = data
+
+	def rows(self):
+		return self.data[:, :self.length]
+
+	def __len__(self):
+		return self.length
+
+	def __iter__(self):
+		return iter(self.data[0, :self.length].tolist())
+
+	def __reversed__(self):
+		return iter(self.data[0, :self.length][::-1].tolist())
+
+	def __getitem__(self, key):
+		items = self.data[0, :self.length][key]
+		return items.tolist() if isinstance(key, slice) else items.item()
+
+	def __repr__(self):
+		return f"{type(self).__name__}(h={self.h}, replicas={self.data.shape[0]}, items={self.length})"
+
+	def append(self, item):
+		self.reserve(self.length + 1)
+		self.data[:, self.length] = item
+		self.length += 1
+
+	def extend(self, items):
+		items = np.asarray(items, dtype=self.data.dtype)
+		k = items.shape[-1] if items.size else 0
+		self.reserve(self.length + k)
+		self.data[:, self.length : self.length+k] = items
+		self.length += k
+
+	def sort(self):
+		self.data[:, :self.length].sort(axis=1)
+
+	# Enough ordering for a compaction: the smallest protected items come
+	# first (in any order, but the largest of them last) and the rest is sorted
+	def partial_sort(self, protected):
+		rows = self.rows()
+		if 0 < protected < self.length:
+			rows.partition(protected - 1, axis=1)
+		rows[:, protected:].sort(axis=1)
+		return rows
+
+	# Every other item of each row from the given start positions (which
+	# take only a few distinct values) on, half items per replica
+	def select(self, rows, starts, half):
+		selected = np.empty((rows.shape[0], half), dtype=rows.dtype)
+		for start in np.unique(starts):
+			chosen = starts == start
+			selected[chosen] = rows[chosen, start : start + 2*half : 2]
+		return selected
+
+	def rank(self, value):
+		return int(np.count_nonzero(self.data[0, :self.length] <= value))
+
+	def as_array(self):
+		return self.data[0, :self.length]
+
+	def split_ranks(self, split_points):
+		return np.searchsorted(self.data[0, :self.length], split_points, side='right').tolist()
+
+	def memory_bytes(self):
+		return self.data.nbytes
+
+class LockstepSimpleLevel(LockstepStorage, jaggedSketchSimple.RelativeCompactor):
+	# Same as RelativeCompactor.compact with a random parity per replica;
+	# the number of compacted items is even
+	def compact(self, protected):
+		# a full compaction may find fewer items than protected
+		protected = min(protected, self.length)
+		rows = self.partial_sort(protected)
+		parity = self.sketch.rng.integers(0, 2, self.data.shape[0])
+		half = (self.length - protected) // 2
+		selected = self.select(rows, protected + parity, half)
+		self.sketch.size -= self.length - protected - half
+		self.length = protected
+		self.num_compactions += 1
+		return selected
+
+class LockstepImprovedLevel(LockstepStorage, jaggedSketchImproved.RelativeCompactor):
+	def __init__(self, sketch):
+		super().__init__(sketch)
+		self.offset = np.zeros(sketch.replicas, dtype=np.int64)
+		self.shift = np.zeros(sketch.replicas, dtype=np.int64)
+
+	def choose_offset_and_shift(self):
+		random_bits = self.sketch.rng.integers(0, 2, self.data.shape[0])
+		if self.num_compactions % 2 == 1:
+			self.offset = 1 - self.offset
+			self.shift = random_bits
+		else:
+			self.offset = random_bits
+			self.shift = 1 - self.shift
+
+	# Same as RelativeCompactor.compact with the offset and shift per replica;
+	# with shift 1 the largest item replaces the largest protected one
+	def compact(self, protected):
+		protected = min(protected, self.length)
+		rows = self.partial_sort(protected)
+		self.choose_offset_and_shift()
+		half = (self.length - protected) // 2
+		selected = self.select(rows, protected + self.offset - self.shift, half)
+		shifted = self.shift == 1
+		rows[shifted, protected - 1] = rows[shifted, self.length - 1]
+		self.sketch.size -= half
+		self.length = protected
+		self.num_compactions += 1
+		return selected
+
+# Creates the lockstep sketch of the given variant ('simple' or 'improved')
+def lockstep_sketch(replicas, variant='simple', **kwargs):
+	if variant == 'simple':
+		return LockstepSimpleSketch(replicas, **kwargs)
+	if variant == 'improved':
+		return LockstepImprovedSketch(replicas, **kwargs)
+	raise ValueError(f"unknown variant {variant}")
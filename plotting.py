@@ -3,7 +3,10 @@ import matplotlib
 import matplotlib.pyplot as plt
 from pprint import pformat
 import sys, os, pickle, subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from JSSTest import Sampling, Data
+from sampleStore import load_samples
 
 def main():
 	if sys.argv[1] == "-":
@@ -18,9 +21,11 @@ class Plotting():
 		add_fig, add_ax = plt.subplots()
 		colours = ['b', 'g', 'r', 'c', 'm', 'y', 'k', 'grey', 'orange', 'purple', 'brown', 'lightgreen']
 		
-		# plot all the datasets
-		for (i, file) in enumerate(files):
-			Plotting.add_dataset(file, rel_ax, add_ax, colours[i])
+		# load the datasets in parallel and plot them
+		with ThreadPoolExecutor() as executor:
+			datasets = list(executor.map(Plotting.load, files))
+		for (i, dataset) in enumerate(datasets):
+			Plotting.add_dataset(dataset, rel_ax, add_ax, colours[i])
 		
 		add_ax.set_xscale('log')
 		rel_ax.set_xscale('log')
@@ -88,20 +93,28 @@ class Plotting():
 		os.remove("add_log_temp.pdf")
 		os.remove("rel_log_temp.pdf")
 		
-	def add_dataset(file, rel_ax, add_ax, colour):
-		with open(file, mode='rb') as file:
-			samples = pickle.load(file)
-		points = samples.sample_points
-		data = samples.data
-		info = samples.info
-		n = samples.n
+	# Reads only the columns needed for the plots (from a columnar .npz
+	# file, or from a pickled Sampling in the old format)
+	def load(file):
+		if file.endswith('.npz'):
+			samples = load_samples(file)
+			perc99 = samples.column('perc99')
+		else:
+			with open(file, mode='rb') as f:
+				samples = pickle.load(f)
+			perc99 = np.asarray(samples.data.perc99)
+		points = np.asarray(samples.sample_points)
+		return (points, perc99, samples.info, samples.n)
+
+	def add_dataset(dataset, rel_ax, add_ax, colour):
+		(points, perc99, info, n) = dataset
 		
 		# plot additive
-		x, y = Plotting.sparsify(points, [z/n for z in data.perc99])
+		x, y = Plotting.sparsify(points, perc99 / n)
 		add, = add_ax.plot(x, y, c=colour, linestyle="-", lw=0.5)
 		
 		# plot relative
-		x, y = Plotting.sparsify(points, [data.perc99[i]/max(points[i], 1) for i in range(len(points))])
+		x, y = Plotting.sparsify(points, perc99 / np.maximum(points, 1))
 		rel, = rel_ax.plot(x, y, c=colour, linestyle="-", lw=0.5)
 		
 		# set legend
@@ -118,16 +131,12 @@ class Plotting():
 		add.set_label(legend)
 		rel.set_label(legend)
 	
+	# Keeps the point with the maximum y from every window of s points
 	def sparsify(x_in, y_in, s=50):
-		x = []
-		y = []
-		i = 0
-		while i <= len(x_in) - s:
-			j, y_j = max(enumerate(y_in[ i : i+s ]), key=lambda t: t[1])
-			x.append(x_in[i+j])
-			y.append(y_j)
-			i+=s
-		return (x, y)
+		m = len(y_in) // s
+		windows = np.reshape(y_in[ : m*s], (m, s))
+		j = np.argmax(windows, axis=1) + np.arange(m) * s
+		return (x_in[j], y_in[j])
 
 if __name__ == '__main__':
 	main()
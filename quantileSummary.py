@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+from bisect import bisect_left, bisect_right
+from numbers import Real
+
+# Fixed-size summary of a sketch: k items with their cumulative weights,
+# chosen so that the gaps between the points follow the relative error
+# profile (small gaps at the tails and around the important quantiles);
+# it needs only the standard library
+class Summary:
+	def __init__(self, items, cum_weights):
+		if len(items) != len(cum_weights):
+			raise ValueError("items and cumulative weights must have the same length")
+		self.items = list(items)
+		self.cum_weights = list(cum_weights)
+
+	# Selects k points from a list of (item, cumulative weight) pairs
+	@classmethod
+	def from_ranks(cls, ranks, k, important_quantiles=()):
+		if k < 2:
+			raise ValueError("a summary needs at least 2 points")
+		chosen = select_points([r for (_, r) in ranks], k, important_quantiles)
+		return cls([ranks[i][0] for i in chosen], [ranks[i][1] for i in chosen])
+
+	# Approximate merge of summaries of disjoint inputs into k points;
+	# the rank of every item is the sum of its ranks in all the summaries
+	@classmethod
+	def merge(cls, summaries, k, important_quantiles=()):
+		items = sorted({x for s in summaries for x in s.items})
+		ranks = [(x, sum(s.rank(x) for s in summaries)) for x in items]
+		return cls.from_ranks(ranks, k, important_quantiles)
+
+	def __len__(self):
+		return len(self.items)
+
+	def total_weight(self):
+		return self.cum_weights[-1] if self.cum_weights else 0
+
+	# The weight of the items not larger than value, interpolated linearly
+	# between the two neighbouring points
+	def rank(self, value):
+		i = bisect_right(self.items, value)
+		if i == 0:
+			return 0
+		if i == len(self.items) or self.items[i-1] == value:
+			return self.cum_weights[i-1]
+		(x0, x1) = (self.items[i-1], self.items[i])
+		(r0, r1) = (self.cum_weights[i-1], self.cum_weights[i])
+		return r0 + (r1 - r0) * (value - x0) / (x1 - x0)
+
+	# The item of rank q times the total weight, interpolated linearly
+	# between the two neighbouring points (the inverse of rank()); for items
+	# that are not numbers the point with the closest cumulative weight
+	def quantile(self, q):
+		assert (q >= 0 and q <= 1), f"parameter q must be in [0, 1], but q = {q}"
+		if not self.items:
+			return None
+		desired_rank = q * self.total_weight()
+		i = bisect_left(self.cum_weights, desired_rank)
+		if i == 0 or i == len(self.items):
+			return self.items[min(i, len(self.items) - 1)]
+		(x0, x1) = (self.items[i-1], self.items[i])
+		(r0, r1) = (self.cum_weights[i-1], self.cum_weights[i])
+		if not (isinstance(x0, Real) and isinstance(x1, Real)):
+			return x0 if desired_rank - r0 < r1 - desired_rank else x1
+		return x0 + (x1 - x0) * (desired_rank - r0) / (r1 - r0)
+
+	def to_dict(self):
+		return {"items": self.items, "cum_weights": self.cum_weights}
+
+	@classmethod
+	def from_dict(cls, d):
+		return cls(d["items"], d["cum_weights"])
+
+# AUXILIARY FUNCTIONS
+# Chooses k indices of the sorted cumulative weights; a point of rank r
+# is given the density 1/gap(r), where gap(r) is the distance of r to the
+# closer end or to the closest important quantile, and the points are
+# spread evenly over the cumulative density
+def select_points(cum_weights, k, important_quantiles=()):
+	m = len(cum_weights)
+	if m <= k:
+		return list(range(m))
+	total = cum_weights[-1]
+	important_ranks = [q * total for q in important_quantiles]
+	density = []
+	previous = 0
+	for r in cum_weights:
+		gap = min(r, total - r + 1)
+		for ir in important_ranks:
+			gap = min(gap, abs(r - ir) + 1)
+		density.append((r - previous) / gap)
+		previous = r
+	# the first and the last points are always kept
+	density[0] = density[-1] = float('inf')
+
+	# every item is chosen at most once, so the share of an item is capped
+	# at one point and the rest is spread over the others: the scale is
+	# found by bisection so that the shares sum up to k
+	shares = lambda scale: [min(1, scale * d) for d in density]
+	(low, high) = (0, 1)
+	while sum(shares(high)) < k:
+		(low, high) = (high, 2 * high)
+	for _ in range(50):
+		middle = (low + high) / 2
+		if sum(shares(middle)) < k:
+			low = middle
+		else:
+			high = middle
+	# k evenly spaced thresholds fall into k distinct items, because no
+	# share is longer than the space between the thresholds
+	chosen = []
+	cum_share = 0
+	step = sum(shares(high)) / k
+	threshold = step / 2
+	for (i, share) in enumerate(shares(high)):
+		cum_share += share
+		while threshold < cum_share and len(chosen) < k:
+			chosen.append(i)
+			threshold += step
+	chosen[-1] = m - 1
+	return chosen
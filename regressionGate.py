@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+import jaggedSketchImproved, jaggedSketchSimple, referenceSketch, referenceSketchSimple
+from spillSketch import SpillingJaggedSketch
+from streamMaker import StreamMaker
+import argparse, json, os, random, sys, time
+from bisect import bisect_right
+
+# Orders whose default StreamMaker parameters give a valid stream
+ORDERS = ['sorted', 'reversed', 'zoomin', 'zoomout', 'sqrt', 'random', 'adv']
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'regression_baseline.json')
+# The sketch of every variant and its frozen reference implementation
+VARIANTS = {
+	'improved': (jaggedSketchImproved.JaggedSketch, referenceSketch.JaggedSketch),
+	'simple': (jaggedSketchSimple.JaggedSketch, referenceSketchSimple.JaggedSketch),
+}
+
+def make_stream(n, order, seed):
+	random.seed(seed)
+	return list(StreamMaker().make(n=n, order=order))
+
+# Everything the sketch keeps, level by level
+def contents(sketch):
+	return [(list(c), c.num_compactions, c.state, c.capacity, c.section_size,
+		getattr(c, 'offset', 0), getattr(c, 'shift', 0)) for c in sketch.compactors]
+
+# The optimized ways of building the sketch of the variant; each must end
+# in exactly the same state as the reference implementation given the same
+# random draws
+def build_paths(variant, stream, epsilon):
+	sketch_class = VARIANTS[variant][0]
+	def per_item():
+		sketch = sketch_class(epsilon=epsilon)
+		for item in stream:
+			sketch.update(item)
+		return sketch
+	def bulk():
+		sketch = sketch_class(epsilon=epsilon)
+		for i in range(0, len(stream), 4096):
+			sketch.update_many(stream[i : i+4096])
+		return sketch
+	def spilled():
+		sketch = SpillingJaggedSketch(epsilon=epsilon, spill_level=1)
+		sketch.update_many(stream)
+		return sketch
+	paths = {'update': per_item, 'update_many': bulk}
+	if variant == 'improved': # the spilling sketch extends the improved variant
+		paths['spilled'] = spilled
+	return paths
+
+def check_differential(variant, stream, epsilon, seed):
+	random.seed(seed)
+	reference = VARIANTS[variant][1](epsilon=epsilon)
+	for item in stream:
+		reference.update(item)
+	expected = contents(reference)
+	expected_ranks = reference.ranks()
+	qs = [0, 0.01, 0.25, 0.5, 0.75, 0.99, 1]
+	expected_quantiles = [reference.quantile(q) for q in qs]
+
+	failures = []
+	for (name, build) in build_paths(variant, stream, epsilon).items():
+		random.seed(seed)
+		sketch = build()
+		if contents(sketch) != expected:
+			failures.append(f"{name}: compactor contents differ")
+			continue
+		if [sketch.quantile(q) for q in qs] != expected_quantiles:
+			failures.append(f"{name}: quantiles differ")
+		if [x for (x, _) in sketch.ranks()] != [x for (x, _) in expected_ranks]:
+			failures.append(f"{name}: ranks() differ")
+		(items, cum_weights) = sketch.ranks_array()
+		if items.tolist() != [x for (x, _) in expected_ranks] or \
+				cum_weights[-1] != expected_ranks[-1][1]:
+			failures.append(f"{name}: ranks_array() differs")
+	return failures
+
+# Percentiles of the relative rank error over geometrically spaced ranks
+def error_percentiles(variant, stream, epsilon, seeds):
+	ordered = sorted(stream)
+	n = len(ordered)
+	points = sorted({ordered[min(n, int(1.05**i)) - 1] for i in range(1000) if 1.05**i <= n})
+	errors = []
+	for seed in seeds:
+		random.seed(seed)
+		sketch = VARIANTS[variant][0](epsilon=epsilon)
+		sketch.update_many(stream)
+		for x in points:
+			true_rank = bisect_right(ordered, x)
+			errors.append(abs(sketch.rank(x) - true_rank) / true_rank)
+	errors.sort()
+	return {'p95': errors[95*len(errors)//100], 'p99': errors[99*len(errors)//100]}
+
+# Items per second of the reference and of both update paths; every run
+# times them back to back and the gate uses the median ratios over the runs,
+# which do not depend on the current speed of the machine
+def throughput(variant, stream, epsilon, runs=7):
+	def feed(sketch):
+		for item in stream:
+			sketch.update(item)
+	(sketch_class, reference_class) = VARIANTS[variant]
+	paths = {
+		'reference': (reference_class, feed),
+		'update': (sketch_class, feed),
+		'update_many': (sketch_class, lambda s: s.update_many(stream)),
+	}
+	speeds = {name: [] for name in paths}
+	for run in range(runs):
+		for (name, (make, fill)) in paths.items():
+			random.seed(run)
+			sketch = make(epsilon=epsilon)
+			start = time.perf_counter()
+			fill(sketch)
+			speeds[name].append(len(stream) / (time.perf_counter() - start))
+	median = lambda values: sorted(values)[len(values) // 2]
+	ratios = lambda name: [s / r for (s, r) in zip(speeds[name], speeds['reference'])]
+	return {
+		'update': median(speeds['update']), 'update_many': median(speeds['update_many']),
+		'update_speedup': median(ratios('update')),
+		'update_many_speedup': median(ratios('update_many')),
+	}
+
+def main():
+	parser = argparse.ArgumentParser(description=
+		'Checks the optimized sketches against the reference implementations and a stored baseline.'
+	)
+	parser.add_argument(
+		'-n', type=int, default=100000,
+		help='the number of items of each workload'
+	)
+	parser.add_argument(
+		'-epsilon', type=float, default=0.01,
+	)
+	parser.add_argument(
+		'-replicas', type=int, default=5,
+		help='the number of sketches for the error percentiles'
+	)
+	parser.add_argument(
+		'-slowdown', type=float, default=20,
+		help='the allowed regression of the speedup over the reference in percent'
+	)
+	parser.add_argument(
+		'-error-slack', type=float, default=10,
+		help='the allowed increase of the error percentiles in percent'
+	)
+	parser.add_argument(
+		'-variant', type=str, default=[], action='append', choices=sorted(VARIANTS),
+		help='the variants to check, default = all'
+	)
+	parser.add_argument(
+		'-baseline', type=str, default=BASELINE,
+		help='the JSON file with the baseline'
+	)
+	parser.add_argument(
+		'--update-baseline', action='store_true',
+		help='store the current measurements as the new baseline'
+	)
+	args = parser.parse_args()
+
+	variants = args.variant if args.variant != [] else sorted(VARIANTS)
+	results = {variant: {} for variant in variants}
+	failures = []
+	for variant in variants:
+		for (i, order) in enumerate(ORDERS):
+			stream = make_stream(args.n, order, seed=i)
+			failures += [f"{variant} {order}: {f}"
+				for f in check_differential(variant, stream, args.epsilon, seed=i)]
+			results[variant][order] = {
+				**error_percentiles(variant, stream, args.epsilon, range(args.replicas)),
+				**throughput(variant, stream, args.epsilon),
+			}
+			print(f"{variant} {order}: " +
+				", ".join(f"{k} {v:.4g}" for (k, v) in results[variant][order].items()))
+
+	if args.update_baseline:
+		workloads = {}
+		if os.path.isfile(args.baseline): # keeps the variants not measured now
+			with open(args.baseline) as file:
+				baseline = json.load(file)
+			if (baseline['n'], baseline['epsilon'], baseline['replicas']) == \
+					(args.n, args.epsilon, args.replicas):
+				workloads = {variant: baseline['workloads'][variant]
+					for variant in VARIANTS if variant in baseline['workloads']}
+		workloads.update(results)
+		with open(args.baseline, mode='w') as file:
+			json.dump({'n': args.n, 'epsilon': args.epsilon, 'replicas': args.replicas,
+				'workloads': workloads}, file, indent=1)
+		print(f"baseline written to {args.baseline}")
+	else:
+		with open(args.baseline) as file:
+			baseline = json.load(file)
+		if (baseline['n'], baseline['epsilon'], baseline['replicas']) != \
+				(args.n, args.epsilon, args.replicas):
+			exit("the baseline was measured with different -n, -epsilon or -replicas")
+		for (variant, workloads) in results.items():
+			for (order, measured) in workloads.items():
+				expected = baseline['workloads'][variant][order]
+				for key in ('p95', 'p99'):
+					if measured[key] > expected[key] * (1 + args.error_slack/100) + 1e-9:
+						failures.append(f"{variant} {order}: {key} error {measured[key]:.4g} "
+							f"> baseline {expected[key]:.4g}")
+				# items/s are only informative, the gate uses the speedups
+				for key in ('update_speedup', 'update_many_speedup'):
+					if measured[key] < expected[key] * (1 - args.slowdown/100):
+						failures.append(f"{variant} {order}: {key} {measured[key]:.3g} "
+							f"< baseline {expected[key]:.3g}")
+
+	for failure in failures:
+		print(f"FAIL {failure}")
+	if failures:
+		sys.exit(1)
+	print("OK")
+
+if __name__ == '__main__':
+	main()
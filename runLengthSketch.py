@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+import jaggedSketchImproved, jaggedSketchSimple
+from random import random
+from heapq import merge
+from itertools import accumulate, chain, groupby, repeat
+from operator import itemgetter
+from collections import Counter
+from bisect import bisect_left, bisect_right
+import sys
+import numpy as np
+
+# Jagged Sketch for inputs with many duplicates: every level stores runs of
+# equal items as (value, multiplicity) pairs and the compactions select
+# every other item of a run by halving its multiplicity, so the memory and
+# the work depend on the number of distinct values per level; the sketch is
+# the same as the one storing every copy (with the same random choices),
+# but ranks() gives one pair per distinct item
+class RunLengthSketch:
+	# Generates the distinct items and their ranks by a k-way merge of the runs
+	def iter_ranks(self, reverse=False):
+		for c in self.compactors:
+			c.sort()
+		if not reverse:
+			levels = [zip(c.values, [n * 2**h for n in c.counts])
+				for (h, c) in enumerate(self.compactors)]
+			cum_weight = 0
+			for (item, runs) in groupby(merge(*levels), key=itemgetter(0)):
+				cum_weight += sum(weight for (_, weight) in runs)
+				yield (item, cum_weight)
+		else:
+			levels = [zip(reversed(c.values), [n * 2**h for n in reversed(c.counts)])
+				for (h, c) in enumerate(self.compactors)]
+			cum_weight = self.total_weight()
+			for (item, runs) in groupby(merge(*levels, reverse=True), key=itemgetter(0)):
+				yield (item, cum_weight)
+				cum_weight -= sum(weight for (_, weight) in runs)
+
+	def ranks(self):
+		return list(self.iter_ranks())
+
+	def ranks_array(self):
+		for c in self.compactors:
+			c.sort()
+		items = np.concatenate([np.array(c.values) for c in self.compactors])
+		weights = np.concatenate([np.array(c.counts, dtype=np.int64) * 2**h
+			for (h, c) in enumerate(self.compactors)])
+		order = np.argsort(items, kind='stable')
+		(items, cum_weights) = (items[order], np.cumsum(weights[order]))
+		last = np.append(items[1:] != items[:-1], True)
+		return (items[last], cum_weights[last])
+
+class RunLengthSimpleSketch(RunLengthSketch, jaggedSketchSimple.JaggedSketch):
+	def new_compactor(self):
+		return RunLengthSimpleLevel(self)
+
+class RunLengthImprovedSketch(RunLengthSketch, jaggedSketchImproved.JaggedSketch):
+	def new_compactor(self):
+		return RunLengthImprovedLevel(self)
+
+# Items selected by a compaction, as runs for the next level
+class Runs:
+	def __init__(self, values, counts):
+		self.values = values
+		self.counts = counts
+		self.length = sum(counts)
+
+	def __len__(self):
+		return self.length
+
+	def __iter__(self):
+		return chain.from_iterable(map(repeat, self.values, self.counts))
+
+# Storage of a level as runs of equal items; it emulates the parts of the
+# list interface used by the sketch, the positions counting every copy;
+# single items (level zero) are buffered and encoded by sort()
+class RunLengthStorage:
+	unlogged = ('values', 'counts', 'length', 'buffer', 'is_sorted')
+
+	def __init__(self, sketch):
+		super().__init__(sketch)
+		self.values = []
+		self.counts = []
+		self.length = 0
+		self.buffer = []
+		self.is_sorted = True
+
+	def __len__(self):
+		return self.length + len(self.buffer)
+
+	def __iter__(self):
+		return chain(chain.from_iterable(map(repeat, self.values, self.counts)), self.buffer)
+
+	def __reversed__(self):
+		return chain(reversed(self.buffer),
+			chain.from_iterable(map(repeat, reversed(self.values), reversed(self.counts))))
+
+	def __getitem__(self, key):
+		if isinstance(key, slice):
+			return list(self)[key]
+		if key < 0:
+			key += len(self)
+		if key < 0 or key >= len(self):
+			raise IndexError("compactor index out of range")
+		if key >= self.length:
+			return self.buffer[key - self.length]
+		return self.values[self.locate(key)[0]]
+
+	# Only contiguous slices are deleted
+	def __delitem__(self, key):
+		start, stop, step = key.indices(len(self))
+		assert step == 1
+		self.delete_range(start, stop)
+
+	def __repr__(self):
+		return f"{type(self).__name__}(h={self.h}, runs={len(self.values)}, items={len(self)})"
+
+	def add_run(self, value, n):
+		if self.values and self.values[-1] == value:
+			self.counts[-1] += n
+		else:
+			self.values.append(value)
+			self.counts.append(n)
+		self.length += n
+
+	def append(self, item):
+		self.buffer.append(item)
+		self.is_sorted = False
+
+	def extend(self, items):
+		if isinstance(items, Runs):
+			self.flush()
+			if items.values:
+				self.add_run(items.values[0], items.counts[0])
+				self.values.extend(items.values[1:])
+				self.counts.extend(items.counts[1:])
+				self.length += len(items) - items.counts[0]
+		else:
+			self.buffer.extend(items)
+		self.is_sorted = False
+
+	# Encodes the buffered items (in their order) as runs
+	def flush(self):
+		for (value, copies) in groupby(self.buffer):
+			self.add_run(value, sum(1 for _ in copies))
+		self.buffer = []
+
+	# Sorts the runs and merges the runs of equal items; the buffered items
+	# are counted at once
+	def sort(self):
+		if self.journal is not None:
+			self.note_appended()
+			self.journal.append(('sort',))
+		if self.is_sorted:
+			return
+		multiplicities = Counter(self.buffer)
+		for (value, n) in zip(self.values, self.counts):
+			multiplicities[value] += n
+		self.values = sorted(multiplicities)
+		self.counts = [multiplicities[value] for value in self.values]
+		self.length += len(self.buffer)
+		self.buffer = []
+		self.is_sorted = True
+
+	# Index of the run at the given position and the position within the run
+	def locate(self, position):
+		cum_counts = list(accumulate(self.counts))
+		i = bisect_right(cum_counts, position)
+		return (i, position - (cum_counts[i-1] if i > 0 else 0))
+
+	# Runs of the items at positions start, start+2, ... below end (of a
+	# sorted level); with the run ends e relative to start (the last one
+	# clipped to end-start), a run takes ceil(e/2) minus the same of the
+	# previous run
+	def every_other(self, start, end):
+		if start >= end:
+			return Runs([], [])
+		cum_counts = list(accumulate(self.counts))
+		i = bisect_right(cum_counts, start)
+		j = bisect_left(cum_counts, end) + 1
+		halves = [(e - start + 1) // 2 for e in cum_counts[i:j]]
+		halves[-1] = (min(cum_counts[j-1], end) - start + 1) // 2
+		values = []
+		counts = []
+		previous = 0
+		for (value, half) in zip(self.values[i:j], halves):
+			if half > previous:
+				values.append(value)
+				counts.append(half - previous)
+			previous = half
+		return Runs(values, counts)
+
+	# Removes the items at positions start, ..., end-1
+	def delete_range(self, start, end):
+		if end <= start:
+			return
+		self.flush()
+		(i, k) = self.locate(start)
+		(j, m) = self.locate(end) if end < self.length else (len(self.values), 0)
+		tail = list(zip(self.values[j:], self.counts[j:]))
+		if tail:
+			tail[0] = (tail[0][0], tail[0][1] - m)
+		value = self.values[i] if k > 0 else None
+		del self.values[i:]
+		del self.counts[i:]
+		self.length = start - k
+		if k > 0:
+			self.add_run(value, k)
+		for (value, n) in tail:
+			self.add_run(value, n)
+
+	def rank(self, value):
+		return sum(n for (v, n) in zip(self.values, self.counts) if v <= value) + \
+			sum(1 for v in self.buffer if v <= value)
+
+	def as_array(self):
+		return np.concatenate([np.repeat(np.array(self.values), self.counts), self.buffer])
+
+	# The level must be sorted
+	def split_ranks(self, split_points):
+		cum_counts = [0] + list(accumulate(self.counts))
+		return [cum_counts[bisect_right(self.values, x)] for x in split_points]
+
+	def memory_bytes(self):
+		total = sys.getsizeof(self.values) + sys.getsizeof(self.counts) + sys.getsizeof(self.buffer)
+		if self.values:
+			total += len(self.values) * (sys.getsizeof(self.values[0]) + sys.getsizeof(self.counts[0]))
+		if self.buffer:
+			total += len(self.buffer) * sys.getsizeof(self.buffer[0])
+		return total
+
+	def stats(self):
+		return dict(super().stats(), runs=len(self.values))
+
+	# The runs are in the attributes; the underlying list is not used (and it
+	# could not be restored before the attributes)
+	def __reduce__(self):
+		return (restore_run_length_level, (type(self), self.__dict__))
+
+class RunLengthSimpleLevel(RunLengthStorage, jaggedSketchSimple.RelativeCompactor):
+	# Same as RelativeCompactor.compact on the runs
+	def compact(self, protected):
+		self.sort()
+		selected = self.every_other(protected + int(random() < 0.5), self.length)
+		end = self.length
+		self.sketch.size -= max(0, end - protected) - len(selected)
+		self.delete_range(protected, end)
+		if self.journal is not None:
+			self.note_deleted(protected, end)
+		self.num_compactions += 1
+		return selected
+
+class RunLengthImprovedLevel(RunLengthStorage, jaggedSketchImproved.RelativeCompactor):
+	# Same as RelativeCompactor.compact on the runs
+	def compact(self, protected):
+		self.sort()
+		self.choose_offset_and_shift()
+		(start, end) = (protected - self.shift, self.length - self.shift)
+		selected = self.every_other(start + self.offset, end)
+		self.sketch.size -= max(0, end - start) - len(selected)
+		self.delete_range(start, end)
+		if self.journal is not None:
+			self.note_deleted(start, end)
+		self.num_compactions += 1
+		return selected
+
+# AUXILIARY FUNCTIONS
+def restore_run_length_level(cls, state):
+	level = cls.__new__(cls)
+	level.__dict__.update(state)
+	return level
+
+# Creates the run-length sketch of the given variant ('simple' or 'improved')
+def run_length_sketch(variant='improved', **kwargs):
+	if variant == 'simple':
+		return RunLengthSimpleSketch(**kwargs)
+	if variant == 'improved':
+		return RunLengthImprovedSketch(**kwargs)
+	raise ValueError(f"unknown variant {variant}")
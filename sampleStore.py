@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+from collections import namedtuple
+import json
+import numpy as np
+
+# Same columns as Data in JSITest and JSSTest
+Data = namedtuple('Data', ['perc68', 'perc95', 'perc99', 'avg', 'median'])
+
+# Columnar storage of Sampling objects from JSITest/JSSTest: every column is
+# a separate array of an uncompressed .npz file, the info is a JSON header
+
+# Writes the sampling to path (which must not exist yet)
+def save_samples(sampling, path):
+	info = {k: sorted(v) if isinstance(v, set) else v for (k, v) in sampling.info.items()}
+	columns = {field: np.asarray(column) for (field, column) in zip(Data._fields, sampling.data)}
+	with open(path, mode='xb') as file:
+		np.savez(file,
+			info=np.array(json.dumps(info)),
+			n=np.array(sampling.n),
+			sample_points=np.asarray(sampling.sample_points),
+			**columns
+		)
+
+# Read-only counterpart of Sampling; the columns are read from the file
+# only when they are accessed
+class StoredSamples():
+	def __init__(self, path):
+		self.file = np.load(path)
+		self.info = json.loads(str(self.file['info']))
+		if 'Q' in self.info:
+			self.info['Q'] = set(self.info['Q'])
+		self.repeat = self.info.get('repeat')
+		self.n = int(self.file['n'])
+
+	@property
+	def sample_points(self):
+		return self.file['sample_points']
+
+	@property
+	def data(self):
+		return Data(*(self.file[field] for field in Data._fields))
+
+	def column(self, field):
+		return self.file[field]
+
+def load_samples(path):
+	return StoredSamples(path)
@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+from jaggedSketchImproved import JaggedSketch, RelativeCompactor
+import sys, tempfile
+import numpy as np
+
+# CONSTANTS
+# Initial number of items reserved in the file of a mapped compactor
+INIT_MAPPED_ITEMS = 1024
+# Number of items converted to Python objects at once when iterating
+ITER_BLOCK = 1 << 16
+
+# Jagged Sketch whose higher levels live in memory-mapped files;
+# levels below spill_level stay in RAM since they are touched most often;
+# queries stream the levels through the k-way merge of iter_ranks()
+class SpillingJaggedSketch(JaggedSketch):
+	def __init__(self, *args, spill_level=3, spill_dtype='float64',
+			spill_dir=None, **kwargs):
+		if spill_level < 1:
+			raise ValueError("spill_level must be at least 1")
+		self.spill_level = spill_level
+		# Items on the mapped levels are stored with this NumPy type
+		self.spill_dtype = np.dtype(spill_dtype)
+		# Directory for the (unlinked) backing files, None for the default
+		self.spill_dir = spill_dir
+		super().__init__(*args, **kwargs)
+
+	def new_compactor(self):
+		if self.H() >= self.spill_level:
+			return MappedCompactor(self, self.spill_dtype, self.spill_dir)
+		return super().new_compactor()
+
+	# The queries below stream the levels through the k-way merge instead of
+	# materializing and sorting all of the items
+
+	def ranks(self):
+		return list(self.iter_ranks())
+
+	def cdf(self):
+		return list(self.iter_cdf())
+
+# Compactor keeping its items in a memory-mapped temporary file; it emulates
+# the parts of the list interface used by the sketch
+class MappedCompactor(RelativeCompactor):
+	unlogged = ('file', 'data', 'length')
+
+	def __init__(self, sketch, dtype, directory=None):
+		super().__init__(sketch)
+		self.dtype = np.dtype(dtype)
+		self.directory = directory
+		self.open_file()
+
+	def open_file(self):
+		self.file = tempfile.TemporaryFile(dir=self.directory)
+		self.length = 0
+		self.data = None
+		self.reserve(INIT_MAPPED_ITEMS)
+
+	# Makes room for n items, doubling the file when it is too small
+	def reserve(self, n):
+		if self.data is not None and len(self.data) >= n:
+			return
+		size = max(n, 2*len(self.data) if self.data is not None else 0)
+		if self.data is not None:
+			self.data.flush()
+		self.file.truncate(size * self.dtype.itemsize)
+		self.data = np.memmap(self.file, dtype=self.dtype, mode='r+', shape=(size,))
+
+	def __len__(self):
+		return self.length
+
+	def __iter__(self):
+		for i in range(0, self.length, ITER_BLOCK):
+			yield from self.data[i : min(i+ITER_BLOCK, self.length)].tolist()
+
+	def __reversed__(self):
+		for i in range(self.length, 0, -ITER_BLOCK):
+			yield from self.data[max(i-ITER_BLOCK, 0) : i][::-1].tolist()
+
+	def __getitem__(self, key):
+		if isinstance(key, slice):
+			return self.data[:self.length][key].tolist()
+		if key < 0:
+			key += self.length
+		if key < 0 or key >= self.length:
+			raise IndexError("compactor index out of range")
+		return self.data[key].item()
+
+	# Only contiguous slices are deleted by the compaction
+	def __delitem__(self, key):
+		start, stop, step = key.indices(self.length)
+		assert step == 1
+		if stop <= start:
+			return
+		tail = self.length - stop
+		self.data[start : start+tail] = self.data[stop : self.length]
+		self.length -= stop - start
+
+	def __repr__(self):
+		return f"MappedCompactor(h={self.h}, items={self.length})"
+
+	def append(self, item):
+		self.reserve(self.length + 1)
+		self.data[self.length] = item
+		self.length += 1
+
+	# New items are always written sequentially after the current ones
+	def extend(self, items):
+		items = np.asarray(items if isinstance(items, (list, np.ndarray)) else list(items),
+			dtype=self.dtype)
+		self.reserve(self.length + len(items))
+		self.data[self.length : self.length+len(items)] = items
+		self.length += len(items)
+
+	def sort(self):
+		if self.journal is not None:
+			self.note_appended()
+			self.journal.append(('sort',))
+		self.data[:self.length].sort()
+
+	def rank(self, value):
+		return int(np.count_nonzero(self.data[:self.length] <= value))
+
+	def as_array(self):
+		return self.data[:self.length]
+
+	def split_ranks(self, split_points):
+		return np.searchsorted(self.data[:self.length], split_points, side='right').tolist()
+
+	# Only the object headers are in the process memory; the items are
+	# paged in from the file on demand
+	def memory_bytes(self):
+		return sys.getsizeof(self) + sys.getsizeof(self.data)
+
+	def mapped_bytes(self):
+		return self.data.nbytes
+
+	# Same as RelativeCompactor.compact, but selects the items by one strided slice
+	def compact(self, protected):
+		self.sort()
+		self.choose_offset_and_shift()
+		(start, end) = (protected - self.shift, self.length - self.shift)
+		selected = self.data[start + self.offset : end : 2].tolist()
+		self.sketch.size -= max(0, end - start) - len(selected)
+		del self[start : end]
+		if self.journal is not None:
+			self.note_deleted(start, end)
+		self.num_compactions += 1
+		return selected
+
+	# The backing file cannot be pickled, so only the items are stored
+	def __reduce__(self):
+		state = {k: v for (k, v) in self.__dict__.items()
+			if k not in ('file', 'data', 'length')}
+		return (restore_mapped_compactor, (state, np.array(self.data[:self.length])))
+
+# AUXILIARY FUNCTIONS
+def restore_mapped_compactor(state, items):
+	compactor = MappedCompactor.__new__(MappedCompactor)
+	compactor.__dict__.update(state)
+	compactor.open_file()
+	compactor.extend(items)
+	return compactor
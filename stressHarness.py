@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+import jaggedSketchImproved, jaggedSketchSimple
+from streamMaker import StreamMaker
+from itertools import islice
+from operator import gt, itemgetter
+from math import log2
+import argparse, json, os, random, sys, time
+
+# CONSTANTS
+ORDERS = ['sorted', 'reversed', 'zoomin', 'zoomout', 'sqrt', 'random',
+	'adv', 'clustered', 'clustered-zoomin']
+MUTATIONS = ['reverse', 'swap', 'sort', 'interleave']
+# Parameters of StreamMaker and the orders using them; the other orders do
+# not depend on them, so their cases have the parameters None (degenerate)
+KNOBS = ('p', 'g', 's')
+ORDER_KNOBS = {'adv': KNOBS, 'clustered': KNOBS, 'clustered-zoomin': KNOBS}
+# Counted in the sketch; they depend only on the input and the random draws
+EXACT_METRICS = ['sort_work', 'sorted_items', 'cascade', 'grows']
+# Worst update time over the mean update time of the same run
+TIMED_METRICS = ['latency_ratio']
+CASES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stress_cases.json')
+
+# Sketch counting the work of its compactions: the items passed to sort()
+# (sorted_items), the same weighted by 1 + log2(runs) of the sorted level,
+# which is how Timsort's work depends on the order (sort_work, see
+# count_runs), the
+# largest number of compactions done by one compress() (cascade) and the
+# calls of grow() (grows); the compaction schedule depends only on the
+# numbers of items, so mostly the sort work depends on the order; the
+# counting copies and scans every sorted level, so the updates are timed
+# on a separate sketch without it (see time_updates)
+class MeasuredSketch:
+	def __init__(self, *args, **kwargs):
+		self.sorted_items = 0
+		self.sort_work = 0
+		self.cascade = 0
+		self.max_cascade = 0
+		self.grows = 0
+		super().__init__(*args, **kwargs)
+
+	def grow(self):
+		self.grows += 1
+		super().grow()
+
+	def compress(self):
+		self.cascade = 0
+		super().compress()
+		self.max_cascade = max(self.max_cascade, self.cascade)
+
+class MeasuredLevel:
+	def sort(self):
+		items = self[:]
+		self.sketch.sorted_items += len(items)
+		if items:
+			self.sketch.sort_work += len(items) * (1 + log2(count_runs(items)))
+		super().sort()
+
+	def compact(self, protected):
+		self.sketch.cascade += 1
+		return super().compact(protected)
+
+class MeasuredSimpleSketch(MeasuredSketch, jaggedSketchSimple.JaggedSketch):
+	def new_compactor(self):
+		return MeasuredSimpleLevel(self)
+
+class MeasuredSimpleLevel(MeasuredLevel, jaggedSketchSimple.RelativeCompactor):
+	pass
+
+class MeasuredImprovedSketch(MeasuredSketch, jaggedSketchImproved.JaggedSketch):
+	def new_compactor(self):
+		return MeasuredImprovedLevel(self)
+
+class MeasuredImprovedLevel(MeasuredLevel, jaggedSketchImproved.RelativeCompactor):
+	pass
+
+# The counting sketch and the timed one of each variant
+# Number of the runs Timsort finds in the items: maximal non-descending or
+# strictly descending ones (the latter are reversed in place), each starting
+# after the previous one; a run from item i spans the equal descent flags
+# from flag i on, and the next flag joins it to the next run
+def count_runs(items):
+	descents = list(map(gt, items, items[1:]))
+	(runs, i) = (0, 0)
+	while i < len(descents):
+		try:
+			i = descents.index(not descents[i], i) + 1
+		except ValueError:
+			i = len(descents) + 1
+		runs += 1
+	# a single item is left after the last run
+	return runs + (i == len(descents))
+
+VARIANTS = {
+	'simple': (MeasuredSimpleSketch, jaggedSketchSimple.JaggedSketch),
+	'improved': (MeasuredImprovedSketch, jaggedSketchImproved.JaggedSketch)
+}
+
+# The input of a case: the first n items of the StreamMaker order with the
+# case's parameters, changed by the given number of random mutations;
+# returns None if the parameters give less than n/2 items
+def make_input(case):
+	random.seed(case['seed']) # the random order uses the global generator
+	knobs = {k: case[k] for k in ORDER_KNOBS.get(case['order'], ())}
+	try:
+		stream = list(islice(StreamMaker().make(n=case['n'], order=case['order'], **knobs), case['n']))
+	except (ValueError, ZeroDivisionError): # e.g. a zero step in range()
+		return None
+	if len(stream) < case['n'] // 2:
+		return None
+	rng = random.Random(case['seed'])
+	for _ in range(case['mutations']):
+		mutate(stream, rng)
+	return stream
+
+# Changes the order within a random block of the stream
+def mutate(stream, rng):
+	size = rng.randint(2, max(2, len(stream) // 4))
+	i = rng.randrange(len(stream) - size + 1)
+	kind = rng.choice(MUTATIONS)
+	block = stream[i : i+size]
+	if kind == 'reverse':
+		block.reverse()
+	elif kind == 'sort':
+		block.sort()
+	elif kind == 'interleave': # the smallest and the largest alternately
+		block.sort()
+		block = [x for pair in zip(block[:size//2], reversed(block[size//2:])) for x in pair] + \
+			(block[size//2 : size//2+1] if size % 2 else [])
+	else: # swap the halves
+		block = block[size//2:] + block[:size//2]
+	stream[i : i+size] = block
+
+# Builds the sketch of the case update by update and returns the counted
+# metrics
+def count_work(case, stream):
+	random.seed(case['seed'])
+	sketch = VARIANTS[case['variant']][0](epsilon=case['epsilon'])
+	for item in stream:
+		sketch.update(item)
+	return {
+		'sort_work': sketch.sort_work / len(stream), 'sorted_items': sketch.sorted_items / len(stream),
+		'cascade': sketch.max_cascade, 'grows': sketch.grows
+	}
+
+# Times every update of the same sketch (the same random draws) without the
+# counting
+def time_updates(case, stream):
+	random.seed(case['seed'])
+	sketch = VARIANTS[case['variant']][1](epsilon=case['epsilon'])
+	clock = time.perf_counter_ns
+	worst = 0
+	start = clock()
+	for item in stream:
+		before = clock()
+		sketch.update(item)
+		elapsed = clock() - before
+		if elapsed > worst:
+			worst = elapsed
+	mean = (clock() - start) / len(stream)
+	return {'latency_ratio': worst / mean, 'worst_update_us': worst / 1000}
+
+def measure(case, stream):
+	return dict(count_work(case, stream), **time_updates(case, stream))
+
+# Metrics of several timed runs; the latency ratio is the smallest one, the
+# counted metrics are the same in every run
+def measure_runs(case, stream, runs):
+	timed = min((time_updates(case, stream) for _ in range(runs)), key=itemgetter('latency_ratio'))
+	return dict(count_work(case, stream), **timed)
+
+def random_case(rng, n, variant, epsilon):
+	case = {
+		'variant': variant, 'epsilon': epsilon, 'n': n, 'order': rng.choice(ORDERS),
+		'p': int(2**rng.uniform(1, 17)), 'g': int(2**rng.uniform(0, 20)) if rng.random() < 0.8 else 0,
+		's': int(2**rng.uniform(0, 7)), 'mutations': rng.choice([0, 0, 1, 2, 4, 8]),
+		'seed': rng.randrange(2**31)
+	}
+	for k in KNOBS:
+		if k not in ORDER_KNOBS.get(case['order'], ()):
+			case[k] = None
+	return case
+
+# A neighbour of the case: one parameter (that the order uses) changed
+def neighbour(case, rng):
+	case = dict(case)
+	key = rng.choice(list(ORDER_KNOBS.get(case['order'], ())) + ['mutations', 'seed'])
+	if key == 'seed':
+		case['seed'] = rng.randrange(2**31)
+	elif key == 'mutations':
+		case['mutations'] = max(0, case['mutations'] + rng.choice([-1, 1]))
+	else:
+		case[key] = max(1 if key != 'g' else 0, int(case[key] * 2**rng.uniform(-1, 1)))
+	return case
+
+# Random search with hill climbing from the worst case found for a metric;
+# returns the worst case and its metrics (measured again by runs runs) for
+# every metric
+def search(n, variant, epsilon, trials, seed, runs=3):
+	rng = random.Random(seed)
+	worst = {}
+	for trial in range(trials):
+		if worst and rng.random() < 0.5:
+			case = neighbour(worst[rng.choice(sorted(worst))][0], rng)
+		else:
+			case = random_case(rng, n, variant, epsilon)
+		stream = make_input(case)
+		if stream is None:
+			continue
+		metrics = measure(case, stream)
+		for metric in EXACT_METRICS + TIMED_METRICS:
+			if metric not in worst or metrics[metric] > worst[metric][1][metric]:
+				worst[metric] = (case, metrics)
+				print(f"trial {trial}: {metric} {metrics[metric]:.4g} by {describe(case)}")
+	return {metric: (case, measure_runs(case, make_input(case), runs))
+		for (metric, (case, _)) in worst.items()}
+
+def describe(case):
+	knobs = ORDER_KNOBS.get(case['order'], ())
+	degenerate = [k for k in KNOBS if k not in knobs]
+	return (f"{case['order']} " + "".join(f"{k}={case[k]} " for k in knobs) +
+		(f"({', '.join(degenerate)} degenerate) " if degenerate else "") +
+		f"mutations={case['mutations']} seed={case['seed']}")
+
+# Re-runs the recorded cases; the counted metrics must not grow by more than
+# slack percent and the latency ratio (best of runs) not by more than the
+# latency slack
+def check(cases, slack, latency_slack, runs=3):
+	failures = []
+	for (metric, recorded) in cases.items():
+		case = recorded['case']
+		stream = make_input(case)
+		metrics = measure_runs(case, stream, runs)
+		print(f"{metric}: {describe(case)}: " + ", ".join(f"{k} {v:.4g}" for (k, v) in metrics.items()))
+		for key in EXACT_METRICS:
+			if metrics[key] > recorded['metrics'][key] * (1 + slack/100) + 1e-9:
+				failures.append(f"{metric}: {key} {metrics[key]:.4g} > recorded {recorded['metrics'][key]:.4g}")
+		if metrics['latency_ratio'] > recorded['metrics']['latency_ratio'] * (1 + latency_slack/100):
+			failures.append(f"{metric}: latency_ratio {metrics['latency_ratio']:.4g} "
+				f"> recorded {recorded['metrics']['latency_ratio']:.4g}")
+	return failures
+
+def main():
+	parser = argparse.ArgumentParser(description=
+		'Searches for inputs with the worst compaction cost and update latency '
+		'and re-checks the recorded ones.'
+	)
+	parser.add_argument(
+		'-n', type=int, default=100000,
+		help='the number of items of each input'
+	)
+	parser.add_argument(
+		'-variant', type=str, default='improved', choices=sorted(VARIANTS),
+	)
+	parser.add_argument(
+		'-epsilon', type=float, default=0.01,
+	)
+	parser.add_argument(
+		'-trials', type=int, default=200,
+		help='the number of inputs tried by the search'
+	)
+	parser.add_argument(
+		'-seed', type=int, default=1,
+		help='the seed of the search'
+	)
+	parser.add_argument(
+		'-slack', type=float, default=5,
+		help='the allowed increase of the counted metrics in percent'
+	)
+	parser.add_argument(
+		'-latency-slack', type=float, default=200,
+		help='the allowed increase of the worst to mean update time ratio in percent'
+	)
+	parser.add_argument(
+		'-cases', type=str, default=CASES,
+		help='the JSON file with the recorded worst cases'
+	)
+	parser.add_argument(
+		'--search', action='store_true',
+		help='search for new worst cases instead of checking the recorded ones'
+	)
+	parser.add_argument(
+		'--record', action='store_true',
+		help='store the worst cases found by the search (with --search)'
+	)
+	args = parser.parse_args()
+
+	if args.search:
+		worst = search(args.n, args.variant, args.epsilon, args.trials, args.seed)
+		for (metric, (case, metrics)) in worst.items():
+			print(f"worst {metric}: {describe(case)}: " +
+				", ".join(f"{k} {v:.4g}" for (k, v) in metrics.items()))
+		if args.record:
+			cases = {}
+			if os.path.isfile(args.cases):
+				with open(args.cases) as file:
+					cases = json.load(file)
+			for (metric, (case, metrics)) in worst.items():
+				cases[f"{args.variant}_{metric}"] = {'case': case, 'metrics': metrics}
+			with open(args.cases, mode='w') as file:
+				json.dump(cases, file, indent=1)
+			print(f"worst cases written to {args.cases}")
+		return
+
+	with open(args.cases) as file:
+		cases = json.load(file)
+	failures = check(cases, args.slack, args.latency_slack)
+	for failure in failures:
+		print(f"FAIL {failure}")
+	if failures:
+		sys.exit(1)
+	print("OK")
+
+if __name__ == '__main__':
+	main()
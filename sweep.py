@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+import jaggedSketchImproved, jaggedSketchSimple
+import JSITest, JSSTest
+from streamMaker import StreamMaker
+from sampleStore import save_samples
+import argparse, hashlib, itertools, json, os, pickle, random
+from collections import Counter
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+# variant: (sketch module, test script with Sampling, suffix of user info)
+VARIANTS = {
+	'improved': (jaggedSketchImproved, JSITest, 'final'),
+	'simple': (jaggedSketchSimple, JSSTest, 'simple'),
+}
+GRID_KEYS = ['variant', 'n', 'order', 'q', 'j', 'epsilon', 'improvement']
+DEFAULT_GRID = {'variant': 'improved', 'q': [0], 'j': 0.5, 'improvement': True,
+	'repeat': 1000, 'info': ''}
+
+# Expands the grid (every key maps to a value or a list of values, quantile
+# sets are lists of quantiles) to the list of configurations
+def expand_grid(grid):
+	grid = {**DEFAULT_GRID, **grid}
+	for key in ('n', 'order', 'epsilon'):
+		if key not in grid:
+			raise ValueError(f"the grid must contain '{key}'")
+	if not isinstance(grid['q'][0], list): # a single quantile set
+		grid['q'] = [grid['q']]
+	values = [grid[k] if isinstance(grid[k], list) else [grid[k]] for k in GRID_KEYS]
+	configs = {}
+	for combination in itertools.product(*values):
+		config = dict(zip(GRID_KEYS, combination))
+		config['q'] = sorted(set(config['q']))
+		if config['epsilon'] <= 0:
+			raise ValueError("the sweep needs explicit epsilons")
+		if config['variant'] == 'simple': # the improvement is not used
+			config['improvement'] = True
+		configs[config_key(config)] = config
+	return (configs, grid['repeat'], grid['info'])
+
+# Hash of the parameters; checkpoints of the replicas are stored under it
+def config_key(config):
+	return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+def checkpoint_path(directory, key, replica):
+	return os.path.join(directory, key, f"{replica}.pkl")
+
+# Materializes the stream of one (n, order) into shared memory; the random
+# order is seeded, so a resumed sweep sees the same stream
+def make_shared_stream(n, order):
+	if order == 'random':
+		rng = np.random.default_rng(n)
+		a = rng.permutation(np.arange(1, n+1))
+	else:
+		a = np.array(list(StreamMaker().make(n=n, order=order)))
+	mem = shared_memory.SharedMemory(create=True, size=a.nbytes)
+	stream = np.ndarray(a.shape, a.dtype, buffer=mem.buf)
+	stream[:] = a[:]
+	return (mem, len(a), a.dtype.str)
+
+# Runs in a worker: builds one replica and checkpoints its ranks
+def run_replica(task):
+	(directory, key, replica, config, mem_name, length, dtype) = task
+	module = VARIANTS[config['variant']][0]
+	random.seed(f"{key}-{replica}")
+	if config['variant'] == 'improved':
+		sketch = module.JaggedSketch(epsilon=config['epsilon'],
+			important_quantiles=set(config['q']), constant_J=config['j'],
+			improvement_for_high_ranks=config['improvement']
+		)
+	else:
+		sketch = module.JaggedSketch(epsilon=config['epsilon'],
+			important_quantiles=set(config['q']), constant_J=config['j']
+		)
+	mem = shared_memory.SharedMemory(mem_name)
+	stream = np.ndarray((length,), np.dtype(dtype), buffer=mem.buf)
+	for i in range(0, length, 1<<20):
+		for item in stream[i : i+(1<<20)].tolist():
+			sketch.update(item)
+	del stream
+	mem.close()
+
+	info = {
+		"n":sketch.N, "cap":sum(c.capacity for c in sketch.compactors),
+		"B":max(c.capacity for c in sketch.compactors), "H":sketch.H(),
+		"J":sketch.J, "epsilon":sketch.epsilon, "Q":sketch.important_quantiles
+	}
+	if config['variant'] == 'improved':
+		info["improvement"] = sketch.improvement_for_high_ranks
+	path = checkpoint_path(directory, key, replica)
+	with open(path + '.tmp', mode='wb') as file:
+		pickle.dump((sketch.ranks(), info), file)
+	os.replace(path + '.tmp', path)
+	return (key, replica)
+
+# Same file names as produced by JSITest and JSSTest, except that streams
+# shorter than a whole million do not collide
+def sample_filename(config, info, user_info):
+	return (
+		f"js_{info['n']/1000000:g}mil_{config['order']}"
+		f"_q{''.join([str(x) for x in info['Q']])}_J{config['j']}"
+		f"_eps{config['epsilon']}_{user_info}"
+		f"{'_noimprovement' if config['improvement']==False else ''}"
+	)
+
+# Merges the checkpoints of all replicas into a Sampling file
+def finalize(directory, key, config, repeat, info_prefix, samples_dir):
+	runs = []
+	for replica in range(repeat):
+		with open(checkpoint_path(directory, key, replica), mode='rb') as file:
+			runs.append(pickle.load(file))
+	(_, test, suffix) = VARIANTS[config['variant']]
+	sketch_info = {**runs[0][1], "repeat": repeat,
+		"user": f"{info_prefix+'_' if info_prefix != '' else ''}{suffix}"}
+	filename = os.path.join(samples_dir,
+		sample_filename(config, sketch_info, sketch_info["user"]) + '.npz')
+	if os.path.isfile(filename):
+		print(f"{filename} already exists")
+		return
+	sampling = test.Sampling([ranks for (ranks, _) in runs], sketch_info, sketch_info["n"])
+	save_samples(sampling, filename)
+	print(f"written {filename}")
+
+def main():
+	parser = argparse.ArgumentParser(description=
+		'Resumable sweep of Jagged Sketch experiments over a parameter grid.'
+	)
+	parser.add_argument(
+		'grid', type=str,
+		help='JSON file with the grid, e.g. {"n": [1000000], "order": ["random"], '
+			'"epsilon": [0.01, 0.005], "j": [0, 0.5], "q": [[0], [0.5, 0.99]], '
+			'"variant": ["improved", "simple"], "repeat": 100}'
+	)
+	parser.add_argument(
+		'-dir', type=str, default='sweep',
+		help='the directory with the checkpoints of finished replicas'
+	)
+	parser.add_argument(
+		'-samples', type=str, default='samples',
+		help='the directory for the resulting Sampling files'
+	)
+	parser.add_argument(
+		'-workers', type=int, default=None,
+		help='the number of worker processes (default: number of CPUs)'
+	)
+	args = parser.parse_args()
+
+	with open(args.grid) as file:
+		(configs, repeat, info_prefix) = expand_grid(json.load(file))
+	os.makedirs(args.samples, exist_ok=True)
+	for key in configs:
+		os.makedirs(os.path.join(args.dir, key), exist_ok=True)
+
+	# skip the replicas finished before an interruption
+	pending = [(key, replica) for key in configs for replica in range(repeat)
+		if not os.path.isfile(checkpoint_path(args.dir, key, replica))]
+	remaining = Counter(key for (key, _) in pending)
+	print(f"{len(configs)} configurations, {len(pending)} of "
+		f"{len(configs)*repeat} runs to do")
+
+	streams = {}
+	try:
+		for (key, _) in pending:
+			config = configs[key]
+			group = (config['n'], config['order'])
+			if group not in streams:
+				streams[group] = make_shared_stream(*group)
+		tasks = []
+		for (key, replica) in pending:
+			config = configs[key]
+			(mem, length, dtype) = streams[(config['n'], config['order'])]
+			tasks.append((args.dir, key, replica, config, mem.name, length, dtype))
+		# largest streams first, so that the long runs do not end up last
+		tasks.sort(key=lambda task: -task[5])
+
+		with mp.Pool(args.workers) as pool:
+			for (key, _) in pool.imap_unordered(run_replica, tasks):
+				remaining[key] -= 1
+				if remaining[key] == 0:
+					finalize(args.dir, key, configs[key], repeat, info_prefix, args.samples)
+	finally:
+		for (mem, _, _) in streams.values():
+			mem.close()
+			mem.unlink()
+
+	# configurations finished before the interruption
+	for key in configs:
+		if key not in remaining:
+			finalize(args.dir, key, configs[key], repeat, info_prefix, args.samples)
+
+if __name__ == '__main__':
+	main()